@@ -1,14 +1,110 @@
-import sys
+import argparse
 
-from .lox import Lox
+from .cache import cache_dir, clear
+from .lox import ENGINES, MAX_DEPTH, PASSES, TOKENIZERS, Lox
 
 
 def main():
-    if len(sys.argv) > 2:
-        print("Usage: plox [script]")
-    lox = Lox()
-    if len(sys.argv) == 2:
-        lox.run_file(sys.argv[1])
+    parser = argparse.ArgumentParser(prog="plox")
+    parser.add_argument("script", nargs="?")
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="tree",
+        help="execution backend (default: tree)",
+    )
+    parser.add_argument(
+        "--emit-python",
+        action="store_true",
+        help="print the Python source the python engine generates for script",
+    )
+    parser.add_argument(
+        "--no-optimize",
+        action="store_true",
+        help="run the AST as parsed, without the optimizer",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="print statistics to stderr",
+    )
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        default=MAX_DEPTH,
+        help="deepest Lox calls can nest with the trampoline and vm engines "
+        f"(default: {MAX_DEPTH})",
+    )
+    parser.add_argument(
+        "--tokenizer",
+        choices=TOKENIZERS,
+        default="fast",
+        help="fast matches a regex per token, scan reads a character at a time, "
+        "buffer is fast but stores tokens in compact arrays, and mmap is fast "
+        "but maps the script into memory instead of reading it (default: fast)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="run each top-level declaration of script as soon as it is parsed",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="run script again whenever it changes, recompiling only the "
+        "top-level declarations that changed",
+    )
+    parser.add_argument(
+        "--lazy",
+        action="store_true",
+        help="parse each function's body when it is first called, instead of "
+        "up front",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="compile script even if it has been compiled before, and don't "
+        "cache the result",
+    )
+    parser.add_argument(
+        "--clear-cache",
+        action="store_true",
+        help="remove every compiled script from the cache",
+    )
+    args = parser.parse_args()
+    if args.emit_python and args.script is None:
+        parser.error("--emit-python needs a script")
+    if args.stream and args.tokenizer not in ("fast", "mmap"):
+        parser.error("--stream only works with --tokenizer=fast or mmap")
+    if args.watch:
+        if args.script is None:
+            parser.error("--watch needs a script")
+        if args.stream or args.emit_python:
+            parser.error("--watch can't be used with --stream or --emit-python")
+        if args.tokenizer != "fast":
+            parser.error("--watch only works with --tokenizer=fast")
+    directory = cache_dir()
+    if args.clear_cache:
+        clear(directory)
+        if args.script is None:
+            return 0
+    lox = Lox(
+        args.engine,
+        [] if args.no_optimize else PASSES,
+        args.stats,
+        args.max_depth,
+        args.tokenizer,
+        None if args.no_cache else directory,
+        args.lazy,
+    )
+    if args.emit_python:
+        lox.emit_python(args.script)
+    elif args.watch:
+        lox.watch(args.script)
+    elif args.stream and args.script is not None:
+        lox.run_stream(args.script)
+    elif args.script is not None:
+        lox.run_file(args.script)
     else:
         lox.run_prompt()
     return 0
@@ -0,0 +1,202 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+from .cache import version
+from .lox import ENGINES, MAX_DEPTH, PASSES, Lox
+
+# The benchmarks directory of a plox checkout
+BENCHMARKS = os.path.join(os.path.dirname(__file__), "..", "..", "benchmarks")
+
+# How much slower than the baseline, in percent, a benchmark has to get before
+# it counts as a regression
+THRESHOLD = 10
+
+
+# The scripts in paths, which can be scripts or directories of them, by name
+def find(paths):
+    scripts = {}
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(n for n in os.listdir(path) if n.endswith(".lox"))
+            files = [os.path.join(path, name) for name in names]
+        else:
+            files = [path]
+        for file in files:
+            scripts[os.path.splitext(os.path.basename(file))[0]] = file
+    return scripts
+
+
+# Compiles and runs source once with engine, returning the seconds it took and
+# what it printed, or None for the seconds if it had errors
+def run(engine, source):
+    lox = Lox(engine, PASSES, False, MAX_DEPTH)
+    out = io.StringIO()
+    # Collect now, so garbage from the last run isn't collected on this one's
+    # time
+    gc.collect()
+    with contextlib.redirect_stdout(out):
+        start = time.perf_counter()
+        try:
+            lox.run(source)
+        except SystemExit:
+            lox.had_error = True
+        elapsed = time.perf_counter() - start
+    if lox.had_error or lox.had_runtime_error:
+        return None, out.getvalue()
+    return elapsed, out.getvalue()
+
+
+# Runs source warmup times untimed, then repeat times timed. Returns the
+# result for the JSON, and what the script printed.
+def measure(engine, source, warmup, repeat):
+    for _ in range(warmup):
+        run(engine, source)
+    times = []
+    for _ in range(repeat):
+        elapsed, output = run(engine, source)
+        if elapsed is None:
+            lines = output.strip().splitlines()
+            return {"error": lines[-1] if lines else "failed"}, output
+        times.append(elapsed)
+    median = statistics.median(times)
+    # The median absolute deviation, which unlike the standard deviation isn't
+    # thrown by the odd run that the machine slowed down
+    spread = statistics.median(abs(t - median) for t in times)
+    return {"median": median, "spread": spread, "times": times}, output
+
+
+def describe(result):
+    if "error" in result:
+        return "error: " + result["error"]
+    median = result["median"]
+    return f"{median * 1000:10.1f} ms ±{result['spread'] / median * 100:5.1f}%"
+
+
+# How result compares to the same benchmark in the baseline, and whether it
+# is more than threshold percent slower
+def compare(result, base, threshold):
+    if base is None or "median" not in base:
+        return "(not in baseline)", False
+    if "median" not in result:
+        return "", True
+    change = (result["median"] / base["median"] - 1) * 100
+    regressed = change > threshold
+    return f"{change:+6.1f}%" + (" REGRESSION" if regressed else ""), regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="plox-bench",
+        description="time Lox scripts with each engine",
+    )
+    parser.add_argument(
+        "scripts",
+        nargs="*",
+        help="scripts, or directories of them, to run (default: the "
+        "benchmarks directory of the plox checkout)",
+    )
+    parser.add_argument(
+        "--engine",
+        action="append",
+        choices=ENGINES,
+        help="engine to run them with, can be given more than once "
+        "(default: all of them)",
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=1,
+        help="untimed runs before the timed ones (default: 1)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="timed runs, of which the median is reported (default: 5)",
+    )
+    parser.add_argument(
+        "--json",
+        metavar="FILE",
+        help="write the results to FILE, to compare against later",
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="FILE",
+        help="compare against results written by --json, and exit with 1 if "
+        "anything got slower than --threshold allows",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=THRESHOLD,
+        help="how much slower than the baseline, in percent, the median can "
+        f"get before it is a regression (default: {THRESHOLD})",
+    )
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    paths = args.scripts or [BENCHMARKS]
+    for path in paths:
+        if not os.path.exists(path):
+            parser.error(f"{path} doesn't exist")
+    scripts = find(paths)
+    if not scripts:
+        parser.error("no scripts to run")
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    engines = args.engine or list(ENGINES)
+
+    results = {}
+    failed = False
+    for name, file in scripts.items():
+        with open(file, encoding="utf-8") as f:
+            source = f.read()
+        results[name] = {}
+        # Every engine should print what the first one that ran it did
+        expected = reference = None
+        for engine in engines:
+            result, output = measure(engine, source, args.warmup, args.repeat)
+            if "error" not in result:
+                if expected is None:
+                    expected, reference = output, engine
+                elif output != expected:
+                    result = {"error": f"printed something other than {reference}"}
+            failed = failed or "error" in result
+            results[name][engine] = result
+            line = f"{name:20} {engine:11} {describe(result)}"
+            if args.baseline is not None:
+                base = baseline.get(name, {}).get(engine)
+                change, regressed = compare(result, base, args.threshold)
+                failed = failed or regressed
+                line += f"  {change}"
+            print(line, flush=True)
+
+    if args.json is not None:
+        report = {
+            "plox": version(),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "warmup": args.warmup,
+            "repeat": args.repeat,
+            "results": results,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
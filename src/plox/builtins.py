@@ -6,4 +6,7 @@ class Clock:
         return 0
 
     def call(self, interpreter, args):
-        return int(time.time())
+        return time.time()
+
+    def __repr__(self):
+        return "<fn clock>"
@@ -0,0 +1,121 @@
+import gc
+import hashlib
+import os
+import pickle
+import tempfile
+from importlib import metadata
+
+# Every entry starts with this, the key it is filed under, and a hash of the
+# pickled statements that follow
+MAGIC = b"plox-ast"
+SUFFIX = ".ast"
+
+
+def version():
+    try:
+        return metadata.version("plox")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+# A hash of the source of plox itself. The version stays the same in a
+# checkout, but any change to the nodes, or to what the resolver and passes
+# fill in on them, is a change to this.
+def fingerprint():
+    digest = hashlib.sha256()
+    package = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(package)):
+        if name.endswith(".py"):
+            digest.update(name.encode() + b"\0")
+            with open(os.path.join(package, name), "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "plox")
+
+
+# Removes every entry in directory
+def clear(directory):
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name.endswith(SUFFIX):
+            os.remove(os.path.join(directory, name))
+
+
+# Resolved and optimized programs, pickled into directory. An entry's key is
+# a hash of the source, the plox version and source and the passes that ran,
+# so a program only ever finds entries compiled from the same source by the
+# same plox. Entries that don't check out are ignored, and overwritten once the
+# program has been compiled again.
+class Cache:
+    def __init__(self, directory, passes):
+        self.directory = directory
+        passes = " ".join(cls.__name__ for cls in passes)
+        self.salt = f"{version()} {fingerprint()} {passes}\n".encode()
+
+    # source is the program's bytes
+    def key(self, source):
+        digest = hashlib.sha256(self.salt)
+        digest.update(source)
+        return digest.digest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key.hex() + SUFFIX)
+
+    # Returns the statements filed under key, or None if there is no valid
+    # entry for it
+    def load(self, key):
+        try:
+            with open(self.path(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        header = MAGIC + key
+        start = len(header) + 32
+        if not data.startswith(header):
+            return None
+        payload = memoryview(data)[start:]
+        if hashlib.sha256(payload).digest() != data[len(header) : start]:
+            return None
+        # Loading makes a great many objects and no garbage, so collecting
+        # while it runs would only waste time
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return pickle.loads(payload)
+        except Exception:
+            return None
+        finally:
+            if enabled:
+                gc.enable()
+
+    def store(self, key, statements):
+        try:
+            payload = pickle.dumps(statements, pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            # Nested too deeply to pickle; it just won't be cached
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, temp = tempfile.mkstemp(dir=self.directory)
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(MAGIC + key + hashlib.sha256(payload).digest())
+                f.write(payload)
+            # Another plox loading the entry sees all of it or none of it
+            os.replace(temp, self.path(key))
+        except OSError:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
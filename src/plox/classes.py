@@ -1,11 +1,39 @@
 from .errors import RuntimeError
 
+# Number of shapes a property access site remembers before it stops adding
+# to its cache
+POLYMORPHIC_LIMIT = 4
+
+
+# Hidden class: maps field names to slots in LoxInstance.values. Instances
+# whose fields were added in the same order share a shape, and adding a field
+# moves an instance along a transition to the next shape.
+class Shape:
+    __slots__ = ("index", "transitions")
+
+    def __init__(self, index):
+        self.index = index
+        self.transitions = {}
+
+    def add(self, name):
+        shape = self.transitions.get(name)
+        if shape is None:
+            index = dict(self.index)
+            index[name] = len(index)
+            shape = self.transitions[name] = Shape(index)
+        return shape
+
 
 class LoxClass:
     def __init__(self, name, superclass, methods):
         self.name = name
         self.superclass = superclass
-        self.methods = methods
+        # Inherited methods are copied down, so lookups never walk the chain
+        self.methods = {} if superclass is None else dict(superclass.methods)
+        self.methods.update(methods)
+        # Each class has its own shape tree, so a shape also identifies the
+        # class and property caches can hold methods as well as fields
+        self.shape = Shape({})
 
     def arity(self):
         initializer = self.find_method("init")
@@ -15,37 +43,98 @@ class LoxClass:
 
     def call(self, interpreter, args):
         instance = LoxInstance(self)
-        init = self.find_method("init")
+        init = self.methods.get("init")
         if init is not None:
-            init.bind(instance).call(interpreter, args)
+            init.call(interpreter, [instance, *args])
         return instance
 
     def find_method(self, name):
-        if self.methods.get(name):
-            return self.methods[name]
-        if self.superclass is not None:
-            return self.superclass.find_method(name)
+        return self.methods.get(name)
 
     def __repr__(self):
         return f"<class {self.name}>"
 
 
+# A method looked up on an instance but not called straight away. Methods take
+# the receiver as their first argument.
+class BoundMethod:
+    __slots__ = ("method", "receiver")
+
+    def __init__(self, method, receiver):
+        self.method = method
+        self.receiver = receiver
+
+    def arity(self):
+        return self.method.arity()
+
+    def call(self, interpreter, args):
+        return self.method.call(interpreter, [self.receiver, *args])
+
+    def __repr__(self):
+        return repr(self.method)
+
+
 class LoxInstance:
+    __slots__ = ("parent", "shape", "values")
+
     def __init__(self, parent):
         self.parent = parent
-        self.fields = {}
-
-    def get(self, field):
-        if self.fields.get(field.lexeme) is not None:
-            return self.fields[field.lexeme]
-        else:
-            method = self.parent.find_method(field.lexeme)
-            if method:
-                return method.bind(self)
-        raise RuntimeError(field, f"undefined property {field.lexeme}")
+        self.shape = parent.shape
+        self.values = []
 
     def set(self, name, value):
-        self.fields[name.lexeme] = value
+        slot = self.shape.index.get(name)
+        if slot is None:
+            self.shape = self.shape.add(name)
+            self.values.append(value)
+        else:
+            self.values[slot] = value
 
     def __repr__(self):
         return f"<instance {self.parent.name}>"
+
+
+# Inline caches. Get and Set nodes remember the entry for the last shape seen
+# in their shape and entry attributes, and up to POLYMORPHIC_LIMIT entries in
+# their cache dict. These functions handle a miss on the last shape.
+
+
+def get_entry(site, instance, name):
+    # For reads the entry is the field's slot, or the method to bind
+    shape = instance.shape
+    cache = site.cache
+    entry = None if cache is None else cache.get(shape)
+    if entry is None:
+        entry = shape.index.get(name.lexeme)
+        if entry is None:
+            entry = instance.parent.find_method(name.lexeme)
+            if entry is None:
+                raise RuntimeError(name, f"undefined property {name.lexeme}")
+        if cache is None:
+            cache = site.cache = {}
+        if len(cache) < POLYMORPHIC_LIMIT:
+            cache[shape] = entry
+    site.shape = shape
+    site.entry = entry
+    return entry
+
+
+def set_entry(site, instance, name):
+    # For writes the entry is the field's slot and, if the field is new, the
+    # shape the instance moves to
+    shape = instance.shape
+    cache = site.cache
+    entry = None if cache is None else cache.get(shape)
+    if entry is None:
+        slot = shape.index.get(name.lexeme)
+        if slot is None:
+            entry = (len(shape.index), shape.add(name.lexeme))
+        else:
+            entry = (slot, None)
+        if cache is None:
+            cache = site.cache = {}
+        if len(cache) < POLYMORPHIC_LIMIT:
+            cache[shape] = entry
+    site.shape = shape
+    site.entry = entry
+    return entry
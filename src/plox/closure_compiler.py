@@ -0,0 +1,576 @@
+from .builtins import Clock
+from .classes import BoundMethod, LoxClass, LoxInstance, get_entry, set_entry
+from .env import Cell, Globals
+from .errors import RuntimeError
+from .expr import Get, Literal
+from .interpreter import stringify
+from .tokenizer import Tt
+
+
+def is_truthy(value):
+    return value is not None and value is not False
+
+
+def numbers_error(op, a, b):
+    return RuntimeError(
+        op, f"operands must be numbers, are {stringify(a)} and {stringify(b)}"
+    )
+
+
+def call_value(interpreter, function, args, paren):
+    if not hasattr(function, "call"):
+        raise RuntimeError(paren, "can only call functions or classes")
+    if len(args) != function.arity():
+        raise RuntimeError(
+            paren,
+            f"wrong argument count: expected {function.arity()}, got {len(args)}",
+        )
+    try:
+        return function.call(interpreter, args)
+    except RecursionError:
+        # Lox calls nest Python calls, so Python's limit is this engine's
+        raise RuntimeError(paren, "Stack overflow") from None
+
+
+class CompiledFun:
+    def __init__(self, declaration, body, cells, is_initializer):
+        self.name = declaration.name.lexeme
+        self.params = declaration.params
+        self.cells = declaration.cells
+        self.body = body
+        self.is_initializer = is_initializer
+        # See fun.Fun
+        self.rest = [None] * declaration.locals + cells[::-1]
+
+    def arity(self):
+        return len(self.params)
+
+    def call(self, interpreter, args):
+        # See fun.Fun
+        frame = args
+        frame += self.rest
+        for slot in self.cells:
+            frame[slot] = Cell(frame[slot])
+        result = self.body(frame)
+        # Methods get this as their first argument
+        if self.is_initializer:
+            this = frame[0]
+            return this.value if type(this) is Cell else this
+        if result is not None:
+            return result[0]
+
+    def bind(self, instance):
+        return BoundMethod(self, instance)
+
+    def __repr__(self):
+        return f"<fn {self.name}>"
+
+
+# Turns the resolved AST into a tree of Python closures, once, so that running
+# a node is a single call instead of an accept/getattr dispatch. Expression
+# closures take the current frame and return a value. Statement closures
+# return None, or a 1-tuple holding the value of an executed return statement.
+class ClosureCompiler:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.g = interpreter.g
+
+    def compile(self, node):
+        return node.accept(self)
+
+    def compile_block(self, statements):
+        compiled = [self.compile(statement) for statement in statements]
+        if len(compiled) == 1:
+            return compiled[0]
+
+        def block(frame):
+            for statement in compiled:
+                result = statement(frame)
+                if result is not None:
+                    return result
+
+        return block
+
+    def variable_getter(self, expr, name):
+        lexeme = name.lexeme
+        if expr.slot is None:
+            g = self.g.dict
+
+            def get_global(frame):
+                if lexeme in g:
+                    return g[lexeme]
+                raise RuntimeError(
+                    name, f"Attempt to access undefined variable {lexeme}"
+                )
+
+            return get_global
+        slot = expr.slot
+        if expr.cell:
+            return lambda frame: frame[slot].value
+        return lambda frame: frame[slot]
+
+    def visit_literal(self, expr):
+        value = expr.value
+        return lambda frame: value
+
+    def visit_grouping(self, expr):
+        return self.compile(expr.expression)
+
+    def visit_variable(self, expr):
+        return self.variable_getter(expr, expr.name)
+
+    def visit_this(self, expr):
+        return self.variable_getter(expr, expr.keyword)
+
+    def visit_assign(self, expr):
+        value = self.compile(expr.value)
+        name = expr.name
+        lexeme = name.lexeme
+        if expr.slot is None:
+            g = self.g.dict
+
+            def assign_global(frame):
+                result = value(frame)
+                if lexeme not in g:
+                    raise RuntimeError(name, f"Undefined variable {lexeme}")
+                g[lexeme] = result
+                return result
+
+            return assign_global
+
+        slot = expr.slot
+        if expr.cell:
+
+            def assign_cell(frame):
+                result = value(frame)
+                frame[slot].value = result
+                return result
+
+            return assign_cell
+
+        def assign(frame):
+            result = value(frame)
+            frame[slot] = result
+            return result
+
+        return assign
+
+    def visit_unary(self, expr):
+        right = self.compile(expr.right)
+        op = expr.operator
+        if op.type == Tt.BANG:
+            return lambda frame: not is_truthy(right(frame))
+
+        def negate(frame):
+            value = right(frame)
+            if type(value) is not float:
+                raise RuntimeError(
+                    op, f"Operand must be a number, is {stringify(value)}"
+                )
+            return -value
+
+        return negate
+
+    def visit_logical(self, expr):
+        left = self.compile(expr.left)
+        right = self.compile(expr.right)
+        if expr.operator.type == Tt.OR:
+
+            def logical_or(frame):
+                value = left(frame)
+                if value is not None and value is not False:
+                    return value
+                return right(frame)
+
+            return logical_or
+
+        def logical_and(frame):
+            value = left(frame)
+            if value is None or value is False:
+                return value
+            return right(frame)
+
+        return logical_and
+
+    def visit_binary(self, expr):
+        left = self.compile(expr.left)
+        right = self.compile(expr.right)
+        op = expr.operator
+
+        match op.type:
+            case Tt.PLUS:
+
+                def add(frame):
+                    a = left(frame)
+                    b = right(frame)
+                    if type(a) is float and type(b) is float:
+                        return a + b
+                    if type(a) is str and type(b) is str:
+                        return a + b
+                    raise RuntimeError(
+                        op,
+                        "can only add numbers or strings, "
+                        f"adding {stringify(a)} and {stringify(b)}",
+                    )
+
+                return add
+            case Tt.MINUS:
+
+                def subtract(frame):
+                    a = left(frame)
+                    b = right(frame)
+                    if type(a) is float and type(b) is float:
+                        return a - b
+                    raise numbers_error(op, a, b)
+
+                return subtract
+            case Tt.STAR:
+
+                def multiply(frame):
+                    a = left(frame)
+                    b = right(frame)
+                    if type(a) is float and type(b) is float:
+                        return a * b
+                    raise numbers_error(op, a, b)
+
+                return multiply
+            case Tt.SLASH:
+
+                def divide(frame):
+                    a = left(frame)
+                    b = right(frame)
+                    if type(a) is not float or type(b) is not float:
+                        raise numbers_error(op, a, b)
+                    if b == 0.0:
+                        raise RuntimeError(op, "Division by 0")
+                    return a / b
+
+                return divide
+            case Tt.GREATER:
+
+                def greater(frame):
+                    a = left(frame)
+                    b = right(frame)
+                    if type(a) is float and type(b) is float:
+                        return a > b
+                    raise numbers_error(op, a, b)
+
+                return greater
+            case Tt.GREATER_EQUAL:
+
+                def greater_equal(frame):
+                    a = left(frame)
+                    b = right(frame)
+                    if type(a) is float and type(b) is float:
+                        return a >= b
+                    raise numbers_error(op, a, b)
+
+                return greater_equal
+            case Tt.LESS:
+
+                def less(frame):
+                    a = left(frame)
+                    b = right(frame)
+                    if type(a) is float and type(b) is float:
+                        return a < b
+                    raise numbers_error(op, a, b)
+
+                return less
+            case Tt.LESS_EQUAL:
+
+                def less_equal(frame):
+                    a = left(frame)
+                    b = right(frame)
+                    if type(a) is float and type(b) is float:
+                        return a <= b
+                    raise numbers_error(op, a, b)
+
+                return less_equal
+            case Tt.BANG_EQUAL:
+                return lambda frame: left(frame) != right(frame)
+            case Tt.EQUAL_EQUAL:
+                return lambda frame: left(frame) == right(frame)
+
+    def visit_call(self, expr):
+        if type(expr.callee) is Get:
+            return self.invoke(expr, expr.callee)
+        callee = self.compile(expr.callee)
+        arguments = [self.compile(arg) for arg in expr.arguments]
+        paren = expr.paren
+        interpreter = self.interpreter
+
+        def call(frame):
+            function = callee(frame)
+            args = [arg(frame) for arg in arguments]
+            return call_value(interpreter, function, args, paren)
+
+        return call
+
+    def invoke(self, expr, get):
+        # Method calls pass the receiver as the first argument instead of
+        # creating a bound method
+        obj = self.compile(get.object)
+        arguments = [self.compile(arg) for arg in expr.arguments]
+        argc = len(arguments)
+        name = get.name
+        paren = expr.paren
+        interpreter = self.interpreter
+
+        def invoke(frame):
+            instance = obj(frame)
+            if type(instance) is not LoxInstance:
+                raise RuntimeError(name, "only instances have properties")
+            if instance.shape is get.shape:
+                entry = get.entry
+            else:
+                entry = get_entry(get, instance, name)
+            if type(entry) is int:
+                # Fields shadow methods, so this calls whatever the field holds
+                args = [arg(frame) for arg in arguments]
+                return call_value(interpreter, instance.values[entry], args, paren)
+            args = [instance]
+            for arg in arguments:
+                args.append(arg(frame))
+            if len(entry.params) != argc:
+                raise RuntimeError(
+                    paren,
+                    f"wrong argument count: expected {len(entry.params)}, got {argc}",
+                )
+            try:
+                return entry.call(interpreter, args)
+            except RecursionError:
+                raise RuntimeError(paren, "Stack overflow") from None
+
+        return invoke
+
+    def visit_get(self, expr):
+        obj = self.compile(expr.object)
+        name = expr.name
+
+        def get(frame):
+            instance = obj(frame)
+            if type(instance) is not LoxInstance:
+                raise RuntimeError(name, "only instances have properties")
+            if instance.shape is expr.shape:
+                entry = expr.entry
+            else:
+                entry = get_entry(expr, instance, name)
+            if type(entry) is int:
+                return instance.values[entry]
+            return entry.bind(instance)
+
+        return get
+
+    def visit_set(self, expr):
+        obj = self.compile(expr.object)
+        value = self.compile(expr.value)
+        name = expr.name
+
+        def set(frame):
+            instance = obj(frame)
+            if type(instance) is not LoxInstance:
+                raise RuntimeError(name, "can only set properties on instances")
+            result = value(frame)
+            if instance.shape is expr.shape:
+                slot, shape = expr.entry
+            else:
+                slot, shape = set_entry(expr, instance, name)
+            if shape is None:
+                instance.values[slot] = result
+            else:
+                instance.values.append(result)
+                instance.shape = shape
+            return result
+
+        return set
+
+    def visit_super(self, expr):
+        slot = expr.slot
+        this = self.compile(expr.this)
+        method = expr.method
+
+        def super_(frame):
+            superclass = frame[slot].value
+            instance = this(frame)
+            found = superclass.find_method(method.lexeme)
+            if found is None:
+                raise RuntimeError(method, f"undefined property {method.lexeme}")
+            return found.bind(instance)
+
+        return super_
+
+    def visit_expression(self, stmt):
+        expr = self.compile(stmt.expr)
+
+        def expression(frame):
+            expr(frame)
+
+        return expression
+
+    def visit_print(self, stmt):
+        expr = self.compile(stmt.expr)
+
+        def print_(frame):
+            print(stringify(expr(frame)))
+
+        return print_
+
+    def definer(self, stmt):
+        # Returns a function storing the variable stmt declares
+        slot = stmt.slot
+        if slot is None:
+            g = self.g.dict
+            name = stmt.name.lexeme
+
+            def define_global(frame, value):
+                g[name] = value
+
+            return define_global
+        if stmt.cell:
+
+            def define_cell(frame, value):
+                frame[slot] = Cell(value)
+
+            return define_cell
+
+        def define(frame, value):
+            frame[slot] = value
+
+        return define
+
+    def visit_var(self, stmt):
+        define = self.definer(stmt)
+        if stmt.initializer is None:
+            return lambda frame: define(frame, None)
+        initializer = self.compile(stmt.initializer)
+        return lambda frame: define(frame, initializer(frame))
+
+    def visit_block(self, stmt):
+        return self.compile_block(stmt.statements)
+
+    def visit_if(self, stmt):
+        condition = self.compile(stmt.condition)
+        thenbranch = self.compile(stmt.thenbranch)
+        if stmt.elsebranch is None:
+
+            def if_(frame):
+                value = condition(frame)
+                if value is not None and value is not False:
+                    return thenbranch(frame)
+
+            return if_
+        elsebranch = self.compile(stmt.elsebranch)
+
+        def if_else(frame):
+            value = condition(frame)
+            if value is not None and value is not False:
+                return thenbranch(frame)
+            return elsebranch(frame)
+
+        return if_else
+
+    def visit_while(self, stmt):
+        condition = self.compile(stmt.condition)
+        body = self.compile(stmt.body)
+
+        if stmt.condition.__class__ is Literal and is_truthy(stmt.condition.value):
+
+            def forever(frame):
+                while True:
+                    result = body(frame)
+                    if result is not None:
+                        return result
+
+            return forever
+
+        def while_(frame):
+            while is_truthy(condition(frame)):
+                result = body(frame)
+                if result is not None:
+                    return result
+
+        return while_
+
+    def visit_return(self, stmt):
+        if stmt.value is None:
+            return lambda frame: (None,)
+        value = self.compile(stmt.value)
+        return lambda frame: (value(frame),)
+
+    def visit_function(self, stmt):
+        body = self.compile_block(stmt.body)
+        captures = stmt.captures
+        if stmt.cell:
+            slot = stmt.slot
+
+            # A function that refers to itself captures its own cell
+            def function_cell(frame):
+                cell = frame[slot] = Cell(None)
+                cells = [frame[capture] for capture in captures]
+                cell.value = CompiledFun(stmt, body, cells, False)
+
+            return function_cell
+        define = self.definer(stmt)
+
+        def function(frame):
+            cells = [frame[capture] for capture in captures]
+            define(frame, CompiledFun(stmt, body, cells, False))
+
+        return function
+
+    def visit_class(self, stmt):
+        name = stmt.name
+        superclass = None
+        if stmt.superclass is not None:
+            superclass = self.compile(stmt.superclass)
+        methods = [
+            (method, self.compile_block(method.body), method.name.lexeme == "init")
+            for method in stmt.methods
+        ]
+        superclass_name = stmt.superclass.name if superclass is not None else None
+        super_slot = stmt.super_slot
+        slot = stmt.slot if stmt.cell else None
+        define = self.definer(stmt)
+
+        def class_(frame):
+            parent = None
+            if superclass is not None:
+                parent = superclass(frame)
+                if not isinstance(parent, LoxClass):
+                    raise RuntimeError(superclass_name, "superclass must be a class")
+                if super_slot is not None:
+                    frame[super_slot] = Cell(parent)
+            if slot is not None:
+                # Methods that refer to the class capture its cell
+                cell = frame[slot] = Cell(None)
+            table = {}
+            for method, body, is_initializer in methods:
+                cells = [frame[capture] for capture in method.captures]
+                table[method.name.lexeme] = CompiledFun(
+                    method, body, cells, is_initializer
+                )
+            klass = LoxClass(name.lexeme, parent, table)
+            if slot is not None:
+                cell.value = klass
+            else:
+                define(frame, klass)
+
+        return class_
+
+
+class ClosureInterpreter:
+    def __init__(self, lox):
+        self.lox = lox
+        self.g = Globals()
+        self.g.define("clock", Clock())
+        # The top level's frame, see Interpreter
+        self.frame = {}
+
+    def interpret(self, statements):
+        compiler = ClosureCompiler(self)
+        compiled = [compiler.compile(statement) for statement in statements]
+        try:
+            for statement in compiled:
+                statement(self.frame)
+        except RuntimeError as e:
+            self.lox.runtime_error(e)
@@ -0,0 +1,416 @@
+from .expr import Get, Literal, Super
+from .tokenizer import Tt
+
+# Opcodes for the bytecode VM. Operands are stored inline in the code list,
+# directly after the opcode they belong to.
+(
+    OP_CONSTANT,
+    OP_NIL,
+    OP_TRUE,
+    OP_FALSE,
+    OP_POP,
+    OP_POPN,
+    OP_GET_LOCAL,
+    OP_SET_LOCAL,
+    OP_GET_CELL,
+    OP_SET_CELL,
+    OP_CELL,
+    OP_GET_UPVALUE,
+    OP_SET_UPVALUE,
+    OP_GET_GLOBAL,
+    OP_SET_GLOBAL,
+    OP_DEFINE_GLOBAL,
+    OP_GET_PROPERTY,
+    OP_SET_PROPERTY,
+    OP_GET_SUPER,
+    OP_EQUAL,
+    OP_NOT_EQUAL,
+    OP_GREATER,
+    OP_GREATER_EQUAL,
+    OP_LESS,
+    OP_LESS_EQUAL,
+    OP_ADD,
+    OP_SUBTRACT,
+    OP_MULTIPLY,
+    OP_DIVIDE,
+    OP_NOT,
+    OP_NEGATE,
+    OP_PRINT,
+    OP_JUMP,
+    OP_JUMP_IF_FALSE,
+    OP_JUMP_IF_TRUE,
+    OP_POP_JUMP_IF_FALSE,
+    OP_CALL,
+    OP_INVOKE,
+    OP_SUPER_INVOKE,
+    OP_CLOSURE,
+    OP_RETURN,
+    OP_CLASS,
+    OP_INHERIT,
+    OP_METHOD,
+) = range(44)
+
+BINARY_OPS = {
+    Tt.EQUAL_EQUAL: OP_EQUAL,
+    Tt.BANG_EQUAL: OP_NOT_EQUAL,
+    Tt.GREATER: OP_GREATER,
+    Tt.GREATER_EQUAL: OP_GREATER_EQUAL,
+    Tt.LESS: OP_LESS,
+    Tt.LESS_EQUAL: OP_LESS_EQUAL,
+    Tt.PLUS: OP_ADD,
+    Tt.MINUS: OP_SUBTRACT,
+    Tt.STAR: OP_MULTIPLY,
+    Tt.SLASH: OP_DIVIDE,
+}
+
+
+class Chunk:
+    def __init__(self):
+        self.code = []
+        self.constants = []
+        self.lines = []
+        self.constant_index = {}
+
+    def write(self, line, *ops):
+        for op in ops:
+            self.code.append(op)
+            self.lines.append(line)
+
+    def add_constant(self, value):
+        # Functions are never shared, everything else is deduplicated by
+        # type as well as value so that 1 and true don't collapse into one
+        if isinstance(value, Prototype):
+            self.constants.append(value)
+            return len(self.constants) - 1
+        key = (type(value), value)
+        if key not in self.constant_index:
+            self.constants.append(value)
+            self.constant_index[key] = len(self.constants) - 1
+        return self.constant_index[key]
+
+
+class Prototype:
+    def __init__(self, name, arity):
+        self.name = name
+        self.arity = arity
+        self.chunk = Chunk()
+        # (is_local, index) pairs describing where each captured cell comes from
+        self.captures = ()
+        # Parameter slots (including the receiver) that have to live in cells
+        self.cells = ()
+
+    def __repr__(self):
+        return f"<fn {self.name}>"
+
+
+# Locals are where the resolver put them, but the resolver numbers a frame
+# from its first argument, which is the receiver for methods. Functions and the
+# script have the callee in slot 0 instead, so their locals are shifted by one.
+class FunctionState:
+    def __init__(self, enclosing, function, proto, kind):
+        self.enclosing = enclosing
+        self.function = function
+        self.proto = proto
+        self.kind = kind
+        self.offset = 1 if kind in ("script", "function") else 0
+        # The number of locals each open scope has on the stack
+        self.scopes = []
+
+
+# Lowers a resolved AST into bytecode for the VM. Like clox, every function
+# gets its own chunk, locals live in stack slots relative to the frame base
+# (slot 0 holds the callee, or the receiver for methods) and globals are looked
+# up by name. Which locals live in cells, and which cells each closure
+# captures, comes from the resolver.
+class Compiler:
+    def __init__(self):
+        self.state = None
+        self.line = 0
+
+    def compile(self, statements):
+        proto = Prototype("script", 0)
+        self.state = FunctionState(None, None, proto, "script")
+        for statement in statements:
+            self.compile_node(statement)
+        self.emit(OP_NIL, OP_RETURN)
+        self.state = None
+        return proto
+
+    def compile_node(self, node):
+        node.accept(self)
+
+    @property
+    def chunk(self):
+        return self.state.proto.chunk
+
+    def emit(self, *ops, line=None):
+        self.chunk.write(self.line if line is None else line, *ops)
+
+    def emit_jump(self, op, line=None):
+        self.emit(op, -1, line=line)
+        return len(self.chunk.code) - 1
+
+    def patch_jump(self, offset):
+        self.chunk.code[offset] = len(self.chunk.code)
+
+    def emit_constant(self, value):
+        self.emit(OP_CONSTANT, self.chunk.add_constant(value))
+
+    def name_constant(self, name):
+        return self.chunk.add_constant(name)
+
+    def begin_scope(self):
+        self.state.scopes.append(0)
+
+    def end_scope(self):
+        count = self.state.scopes.pop()
+        if count == 1:
+            self.emit(OP_POP)
+        elif count > 1:
+            self.emit(OP_POPN, count)
+
+    def declare_variable(self, stmt):
+        # Stores the value on top of the stack as the variable stmt declares
+        if stmt.slot is None:
+            self.emit(OP_DEFINE_GLOBAL, self.name_constant(stmt.name.lexeme))
+            return
+        self.state.scopes[-1] += 1
+        if stmt.cell:
+            self.emit(OP_CELL)
+
+    # node is any node the resolver gave a slot, referring to the variable name
+    def get_variable(self, node, name, line):
+        slot = node.slot
+        if slot is None:
+            self.emit(OP_GET_GLOBAL, self.name_constant(name), line=line)
+        elif slot < 0:
+            self.emit(OP_GET_UPVALUE, -1 - slot, line=line)
+        else:
+            op = OP_GET_CELL if node.cell else OP_GET_LOCAL
+            self.emit(op, slot + self.state.offset, line=line)
+
+    def set_variable(self, node, name, line):
+        slot = node.slot
+        if slot is None:
+            self.emit(OP_SET_GLOBAL, self.name_constant(name), line=line)
+        elif slot < 0:
+            self.emit(OP_SET_UPVALUE, -1 - slot, line=line)
+        else:
+            op = OP_SET_CELL if node.cell else OP_SET_LOCAL
+            self.emit(op, slot + self.state.offset, line=line)
+
+    def function(self, stmt, kind):
+        proto = Prototype(stmt.name.lexeme, len(stmt.params))
+        state = FunctionState(self.state, stmt, proto, kind)
+        self.state = state
+        self.begin_scope()
+        for statement in stmt.body:
+            self.compile_node(statement)
+        self.emit_return()
+        self.state = state.enclosing
+
+        # Read once the body has been compiled, as lazy bodies are only
+        # resolved when they are first used
+        proto.cells = tuple(slot + state.offset for slot in stmt.cells)
+        offset = self.state.offset
+        proto.captures = tuple(
+            (True, slot + offset) if slot >= 0 else (False, -1 - slot)
+            for slot in stmt.captures
+        )
+        self.emit(OP_CLOSURE, self.chunk.add_constant(proto), line=stmt.name.line)
+
+    def emit_return(self):
+        state = self.state
+        if state.kind == "initializer":
+            # this is the receiver, in slot 0
+            op = OP_GET_CELL if 0 in state.function.cells else OP_GET_LOCAL
+            self.emit(op, 0)
+        else:
+            self.emit(OP_NIL)
+        self.emit(OP_RETURN)
+
+    def visit_expression(self, stmt):
+        self.compile_node(stmt.expr)
+        self.emit(OP_POP)
+
+    def visit_print(self, stmt):
+        self.compile_node(stmt.expr)
+        self.emit(OP_PRINT)
+
+    def visit_var(self, stmt):
+        self.line = stmt.name.line
+        if stmt.initializer is not None:
+            self.compile_node(stmt.initializer)
+        else:
+            self.emit(OP_NIL)
+        self.declare_variable(stmt)
+
+    def visit_block(self, stmt):
+        self.begin_scope()
+        for statement in stmt.statements:
+            self.compile_node(statement)
+        self.end_scope()
+
+    def visit_if(self, stmt):
+        self.compile_node(stmt.condition)
+        else_jump = self.emit_jump(OP_POP_JUMP_IF_FALSE)
+        self.compile_node(stmt.thenbranch)
+        if stmt.elsebranch is not None:
+            end_jump = self.emit_jump(OP_JUMP)
+            self.patch_jump(else_jump)
+            self.compile_node(stmt.elsebranch)
+            self.patch_jump(end_jump)
+        else:
+            self.patch_jump(else_jump)
+
+    def visit_while(self, stmt):
+        loop_start = len(self.chunk.code)
+        condition = stmt.condition
+        value = condition.value if condition.__class__ is Literal else None
+        if value is not None and value is not False:
+            # for (;;) and while (true) loops, which only exit by returning
+            self.compile_node(stmt.body)
+            self.emit(OP_JUMP, loop_start)
+            return
+        self.compile_node(condition)
+        exit_jump = self.emit_jump(OP_POP_JUMP_IF_FALSE)
+        self.compile_node(stmt.body)
+        self.emit(OP_JUMP, loop_start)
+        self.patch_jump(exit_jump)
+
+    def visit_return(self, stmt):
+        self.line = stmt.keyword.line
+        if stmt.value is None:
+            self.emit_return()
+        else:
+            self.compile_node(stmt.value)
+            self.emit(OP_RETURN)
+
+    def visit_function(self, stmt):
+        self.line = stmt.name.line
+        if stmt.slot is None:
+            self.function(stmt, "function")
+            self.emit(OP_DEFINE_GLOBAL, self.name_constant(stmt.name.lexeme))
+            return
+        # The local has to exist before the body is compiled so that the
+        # function can refer to itself
+        self.state.scopes[-1] += 1
+        if stmt.cell:
+            self.emit(OP_NIL, OP_CELL)
+            self.function(stmt, "function")
+            self.emit(OP_SET_CELL, stmt.slot + self.state.offset, OP_POP)
+        else:
+            self.function(stmt, "function")
+
+    def visit_class(self, stmt):
+        name = stmt.name
+        self.line = name.line
+        self.emit(OP_CLASS, self.name_constant(name.lexeme))
+        self.declare_variable(stmt)
+
+        if stmt.superclass is not None:
+            self.compile_node(stmt.superclass)
+            self.get_variable(stmt, name.lexeme, name.line)
+            self.emit(OP_INHERIT, line=stmt.superclass.name.line)
+            self.begin_scope()
+            self.state.scopes[-1] += 1
+            if stmt.super_slot is not None:
+                self.emit(OP_CELL)
+
+        self.get_variable(stmt, name.lexeme, name.line)
+        for method in stmt.methods:
+            kind = "initializer" if method.name.lexeme == "init" else "method"
+            self.function(method, kind)
+            self.emit(OP_METHOD, self.name_constant(method.name.lexeme))
+        self.emit(OP_POP)
+
+        if stmt.superclass is not None:
+            self.end_scope()
+
+    def visit_literal(self, expr):
+        if expr.value is None:
+            self.emit(OP_NIL)
+        elif expr.value is True:
+            self.emit(OP_TRUE)
+        elif expr.value is False:
+            self.emit(OP_FALSE)
+        else:
+            self.emit_constant(expr.value)
+
+    def visit_grouping(self, expr):
+        self.compile_node(expr.expression)
+
+    def visit_unary(self, expr):
+        self.compile_node(expr.right)
+        op = OP_NEGATE if expr.operator.type == Tt.MINUS else OP_NOT
+        self.emit(op, line=expr.operator.line)
+
+    def visit_binary(self, expr):
+        self.compile_node(expr.left)
+        self.compile_node(expr.right)
+        self.emit(BINARY_OPS[expr.operator.type], line=expr.operator.line)
+
+    def visit_logical(self, expr):
+        self.compile_node(expr.left)
+        op = OP_JUMP_IF_TRUE if expr.operator.type == Tt.OR else OP_JUMP_IF_FALSE
+        end_jump = self.emit_jump(op)
+        self.emit(OP_POP)
+        self.compile_node(expr.right)
+        self.patch_jump(end_jump)
+
+    def visit_variable(self, expr):
+        self.get_variable(expr, expr.name.lexeme, expr.name.line)
+
+    def visit_assign(self, expr):
+        self.compile_node(expr.value)
+        self.set_variable(expr, expr.name.lexeme, expr.name.line)
+
+    def visit_this(self, expr):
+        self.get_variable(expr, "this", expr.keyword.line)
+
+    def visit_super(self, expr):
+        self.get_variable(expr.this, "this", expr.keyword.line)
+        self.get_variable(expr, "super", expr.keyword.line)
+        self.emit(
+            OP_GET_SUPER,
+            self.name_constant(expr.method.lexeme),
+            line=expr.method.line,
+        )
+
+    def visit_call(self, expr):
+        if isinstance(expr.callee, Get):
+            self.compile_node(expr.callee.object)
+            for arg in expr.arguments:
+                self.compile_node(arg)
+            self.emit_invoke(OP_INVOKE, expr.callee.name, expr)
+        elif isinstance(expr.callee, Super):
+            self.get_variable(expr.callee.this, "this", expr.callee.keyword.line)
+            for arg in expr.arguments:
+                self.compile_node(arg)
+            self.get_variable(expr.callee, "super", expr.callee.keyword.line)
+            self.emit_invoke(OP_SUPER_INVOKE, expr.callee.method, expr)
+        else:
+            self.compile_node(expr.callee)
+            for arg in expr.arguments:
+                self.compile_node(arg)
+            self.emit(OP_CALL, len(expr.arguments), line=expr.paren.line)
+
+    def emit_invoke(self, op, name, expr):
+        # Property errors are reported on the name, call errors on the paren,
+        # so the name operand carries its own line
+        self.emit(op, line=expr.paren.line)
+        self.emit(self.name_constant(name.lexeme), line=name.line)
+        self.emit(len(expr.arguments), line=expr.paren.line)
+
+    def visit_get(self, expr):
+        self.compile_node(expr.object)
+        self.emit(
+            OP_GET_PROPERTY, self.name_constant(expr.name.lexeme), line=expr.name.line
+        )
+
+    def visit_set(self, expr):
+        self.compile_node(expr.object)
+        self.compile_node(expr.value)
+        self.emit(
+            OP_SET_PROPERTY, self.name_constant(expr.name.lexeme), line=expr.name.line
+        )
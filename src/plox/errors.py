@@ -3,13 +3,9 @@ class ParseError(Exception):
 
 
 class RuntimeError(Exception):
-    def __init__(self, token, msg):
+    # Backends that don't keep tokens around at run time pass the line directly
+    def __init__(self, token, msg, line=None):
         super().__init__(msg)
         self.token = token
+        self.line = token.line if line is None else line
 
-
-# Not exactly an error, just a way to jump out of a deep call stack
-class ReturnError(Exception):
-    def __init__(self, value):
-        super().__init__()
-        self.value = value
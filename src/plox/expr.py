@@ -1,32 +1,35 @@
+from .nodes import make_node
+
+
 class Expr:
-    pass
+    __slots__ = ()
 
 
 # This is just a convenience method which allows us to elide full class definitions
 # The first argument is the class name, and the remaining arguments are the parameters that the class takes
 # The function generates a class accepting those parameters, as well as an accept method for the visitor pattern
-def _makeclass(*args1):
-    def init(self, *args2):
-        super(Expr, self).__init__()
-        for key, value in zip(args1[1:], args2):
-            setattr(self, key, value)
-
-    def accept(self, visitor):
-        funcname = f"visit_{args1[0].lower()}"
-        return getattr(visitor, funcname)(self)
-
-    return type(args1[0], (Expr,), {"__init__": init, "accept": accept})
+# Every node also gets calls, which the trampoline sets on nodes that contain a
+# call, see trampoline.TrampolineInterpreter.find_calls
+def _makeclass(*args, **defaults):
+    return make_node(Expr, *args, calls=False, **defaults)
 
 
-Assign = _makeclass("Assign", "name", "value")
-Binary = _makeclass("Binary", "left", "operator", "right")
+# slot and cell are filled in by the resolver on nodes that refer to a
+# variable: the variable's slot in the current function's frame, and whether
+# that slot holds a Cell. Globals keep a slot of None. Super also gets a This
+# node for the receiver. shape, entry and cache hold the inline cache of
+# property accesses, see classes.get_entry. deopts counts how many times the
+# tree-walker had to take a Binary or Unary site's specialized handler away,
+# see interpreter.quickened.
+Assign = _makeclass("Assign", "name", "value", slot=None, cell=False)
+Binary = _makeclass("Binary", "left", "operator", "right", deopts=0)
 Call = _makeclass("Call", "callee", "paren", "arguments")
-Get = _makeclass("Get", "object", "name")
+Get = _makeclass("Get", "object", "name", shape=None, entry=None, cache=None)
 Grouping = _makeclass("Grouping", "expression")
 Literal = _makeclass("Literal", "value")
 Logical = _makeclass("Logical", "left", "operator", "right")
-Set = _makeclass("Set", "object", "name", "value")
-Super = _makeclass("Super", "keyword", "method")
-This = _makeclass("This", "keyword")
-Unary = _makeclass("Unary", "operator", "right")
-Variable = _makeclass("Variable", "name")
+Set = _makeclass("Set", "object", "name", "value", shape=None, entry=None, cache=None)
+Super = _makeclass("Super", "keyword", "method", slot=None, cell=False, this=None)
+This = _makeclass("This", "keyword", slot=None, cell=False)
+Unary = _makeclass("Unary", "operator", "right", deopts=0)
+Variable = _makeclass("Variable", "name", slot=None, cell=False)
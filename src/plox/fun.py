@@ -1,34 +1,64 @@
-from .env import Env
-from .errors import ReturnError
+from .classes import BoundMethod
+from .env import Cell
+from .stmt import LazyFunction
 
 
 class Fun:
-    def __init__(self, declaration, closure, is_initializer):
+    def __init__(self, declaration, cells, is_initializer):
         self.declaration = declaration
-        self.closure = closure
         self.is_initializer = is_initializer
+        # A call's frame is its arguments followed by this: the other locals,
+        # then the captured cells in reverse, see resolver.FunctionState
+        self.rest = [None] * declaration.locals + cells[::-1]
 
     def arity(self):
         return len(self.declaration.params)
 
     def call(self, interpreter, args):
-        env = Env(self.closure)
-        for param, arg in zip(self.declaration.params, args):
-            env.define(param.lexeme, arg)
-        try:
-            interpreter.eval_block(self.declaration.body, env)
-        except ReturnError as e:
-            if self.is_initializer:
-                return self.closure.get_at(0, "this")
-            return e.value
-
+        # Nothing keeps a frame once the call returns, since closures only
+        # hold cells, and callers always pass a new list of arguments, so the
+        # frame is made by extending that list instead of copying it
+        frame = args
+        frame += self.rest
+        for slot in self.declaration.cells:
+            frame[slot] = Cell(frame[slot])
+        result = interpreter.eval_block(self.declaration.body, frame)
+        # Methods get this as their first argument
         if self.is_initializer:
-            return self.closure.get_at(0, "this")
+            this = frame[0]
+            return this.value if type(this) is Cell else this
+        if result is not None:
+            return result[0]
 
     def bind(self, instance):
-        env = Env(self.closure)
-        env.define("this", instance)
-        return Fun(self.declaration, env, self.is_initializer)
+        return BoundMethod(self, instance)
 
     def __repr__(self):
-        return f"<fn {self.declaration.name}>"
+        return f"<fn {self.declaration.name.lexeme}>"
+
+
+# The function for a LazyFunction whose body hasn't been parsed yet. The first
+# call parses it, after which the function becomes a plain Fun.
+class LazyFun(Fun):
+    def __init__(self, declaration, cells, is_initializer):
+        self.declaration = declaration
+        self.is_initializer = is_initializer
+        # The frame can't be laid out until the body has been resolved
+        self.cells = cells
+
+    def force(self):
+        # Another closure of the same declaration may have been called first
+        if self.declaration.__class__ is LazyFunction:
+            self.declaration.parse()
+        self.__class__ = Fun
+        Fun.__init__(self, self.declaration, self.cells, self.is_initializer)
+
+    def call(self, interpreter, args):
+        self.force()
+        return Fun.call(self, interpreter, args)
+
+
+def make_fun(declaration, cells, is_initializer):
+    if declaration.__class__ is LazyFunction:
+        return LazyFun(declaration, cells, is_initializer)
+    return Fun(declaration, cells, is_initializer)
@@ -1,18 +1,69 @@
 from .builtins import Clock
-from .classes import LoxClass, LoxInstance
-from .env import Env
-from .errors import ReturnError, RuntimeError
-from .fun import Fun
+from .classes import LoxClass, LoxInstance, get_entry, set_entry
+from .env import Cell, Globals
+from .expr import Binary, Get, Literal, Unary
+from .errors import RuntimeError
+from .fun import make_fun
+from .nodes import Visitor, walk
 from .tokenizer import Tt
 
 
-class Interpreter:
+def stringify(value):
+    if value is None:
+        return None
+    # Whole numbers print without the .0; infinities and nan aren't whole
+    elif type(value) is float and value.is_integer():
+        return f"{int(value)}"
+    else:
+        return str(value)
+
+
+# After this many failed guards a site stays generic
+DEOPT_LIMIT = 4
+
+
+# Binary and Unary sites quicken: the generic handler looks at the types of the
+# operands, and if there is a handler specialized for them, switches the node
+# to a subclass run by that handler, by assigning its __class__. Subclasses add
+# no slots, so the node stays the same object for every other pass.
+def quickened(base, handler, kind):
+    namespace = {"__slots__": (), "handler": handler, "kind": kind}
+    return type(base.__name__, (base,), namespace)
+
+
+# Keyed by operator and operand types, or by the operator alone for operators
+# that work on values of any type
+QUICK_BINARY = {
+    (Tt.PLUS, float, float): quickened(Binary, "visit_add_float", "float"),
+    (Tt.PLUS, str, str): quickened(Binary, "visit_add_str", "str"),
+    (Tt.MINUS, float, float): quickened(Binary, "visit_subtract_float", "float"),
+    (Tt.STAR, float, float): quickened(Binary, "visit_multiply_float", "float"),
+    (Tt.SLASH, float, float): quickened(Binary, "visit_divide_float", "float"),
+    (Tt.GREATER, float, float): quickened(Binary, "visit_greater_float", "float"),
+    (Tt.GREATER_EQUAL, float, float): quickened(
+        Binary, "visit_greater_equal_float", "float"
+    ),
+    (Tt.LESS, float, float): quickened(Binary, "visit_less_float", "float"),
+    (Tt.LESS_EQUAL, float, float): quickened(Binary, "visit_less_equal_float", "float"),
+    Tt.EQUAL_EQUAL: quickened(Binary, "visit_equal", "any"),
+    Tt.BANG_EQUAL: quickened(Binary, "visit_not_equal", "any"),
+}
+
+QUICK_UNARY = {
+    (Tt.MINUS, float): quickened(Unary, "visit_negate_float", "float"),
+    Tt.BANG: quickened(Unary, "visit_not", "any"),
+}
+
+
+class Interpreter(Visitor):
     def __init__(self, lox):
+        super().__init__()
         self.lox = lox
-        self.g = Env()
+        self.g = Globals()
         self.g.define("clock", Clock())
-        self.env = self.g
-        self.locals = {}
+        # The frame of the running function. The top level has no function
+        # to size its frame, so its locals go in a dict keyed by slot.
+        self.frame = {}
 
     def is_truthy(self, expr):
         if expr is None:
@@ -28,24 +79,32 @@ class Interpreter:
         if type(a) is float and type(b) is float:
             return
         raise RuntimeError(
-            op, f"operands must be numbers, are {a.literal} and {b.literal}"
+            op,
+            f"operands must be numbers, are {self.stringify(a)} and {self.stringify(b)}",
         )
 
     def stringify(self, value):
-        if value is None:
-            return None
-        # Quick hack to check if x==x.0
-        elif type(value) is float and float(value) == float(int(value)):
-            return f"{int(value)}"
-        else:
-            return str(value)
+        return stringify(value)
 
     def lookup_variable(self, name, expr):
-        distance = self.locals.get(expr)
-        if distance is not None:
-            return self.env.get_at(distance, name.lexeme)
-        else:
+        if expr.slot is None:
             return self.g.get(name)
+        if expr.cell:
+            return self.frame[expr.slot].value
+        return self.frame[expr.slot]
+
+    def define(self, stmt, value):
+        if stmt.slot is None:
+            self.g.define(stmt.name.lexeme, value)
+        elif stmt.cell:
+            self.frame[stmt.slot] = Cell(value)
+        else:
+            self.frame[stmt.slot] = value
+
+    # The cells a function declared in the running one closes over
+    def captured(self, stmt):
+        frame = self.frame
+        return [frame[slot] for slot in stmt.captures]
 
     def visit_literal(self, expr):
         return expr.value
@@ -55,46 +114,113 @@ class Interpreter:
 
     def visit_unary(self, expr):
         right = self.eval(expr.right)
-        if expr.operator.type == Tt.MINUS:
+        if expr.deopts < DEOPT_LIMIT:
+            op = expr.operator.type
+            quick = QUICK_UNARY.get(op) or QUICK_UNARY.get((op, type(right)))
+            if quick is not None:
+                expr.__class__ = quick
+        return self.unary(expr.operator, right)
+
+    def unary(self, op, right):
+        if op.type == Tt.MINUS:
             if type(right) is not float:
                 raise RuntimeError(
-                    self.right, f"Operand must be an umber, is {right.literal}"
+                    op, f"Operand must be a number, is {self.stringify(right)}"
                 )
             return -float(right)
-        elif expr.operator.type == Tt.BANG:
+        elif op.type == Tt.BANG:
             return not self.is_truthy(right)
 
+    def visit_negate_float(self, expr):
+        right = self.eval(expr.right)
+        if type(right) is float:
+            return -right
+        expr.__class__ = Unary
+        expr.deopts += 1
+        return self.unary(expr.operator, right)
+
+    def visit_not(self, expr):
+        return not self.is_truthy(self.eval(expr.right))
+
     def visit_call(self, expr):
+        if expr.callee.__class__ is Get:
+            return self.invoke(expr, expr.callee)
         callee = self.eval(expr.callee)
         args = [self.eval(arg) for arg in expr.arguments]
+        return self.call(callee, args, expr.paren)
+
+    def call(self, callee, args, paren):
         if not hasattr(callee, "call"):
-            raise RuntimeError(expr.paren, "can only call functions or classes")
+            raise RuntimeError(paren, "can only call functions or classes")
         if len(args) != callee.arity():
             raise RuntimeError(
-                expr.paren,
+                paren,
                 f"wrong argument count: expected {callee.arity()}, got {len(args)}",
             )
-        return callee.call(self, args)
+        try:
+            return callee.call(self, args)
+        except RecursionError:
+            # Lox calls nest Python calls, so Python's limit is this engine's
+            raise RuntimeError(paren, "Stack overflow") from None
+
+    # Calls a method without creating a bound method for it, by passing the
+    # receiver as the first argument directly
+    def invoke(self, expr, get):
+        ob = self.eval(get.object)
+        if type(ob) is not LoxInstance:
+            raise RuntimeError(get.name, "only instances have properties")
+        if ob.shape is get.shape:
+            entry = get.entry
+        else:
+            entry = get_entry(get, ob, get.name)
+        if type(entry) is int:
+            # Fields shadow methods, so this calls whatever the field holds
+            args = [self.eval(arg) for arg in expr.arguments]
+            return self.call(ob.values[entry], args, expr.paren)
+        args = [ob]
+        for arg in expr.arguments:
+            args.append(self.eval(arg))
+        if len(args) - 1 != entry.arity():
+            raise RuntimeError(
+                expr.paren,
+                f"wrong argument count: expected {entry.arity()}, got {len(args) - 1}",
+            )
+        try:
+            return entry.call(self, args)
+        except RecursionError:
+            raise RuntimeError(expr.paren, "Stack overflow") from None
 
     def visit_get(self, expr):
         ob = self.eval(expr.object)
-        if not isinstance(ob, LoxInstance):
+        if type(ob) is not LoxInstance:
             raise RuntimeError(expr.name, "only instances have properties")
+        if ob.shape is expr.shape:
+            entry = expr.entry
         else:
-            return ob.get(expr.name)
+            entry = get_entry(expr, ob, expr.name)
+        if type(entry) is int:
+            return ob.values[entry]
+        return entry.bind(ob)
 
     def visit_set(self, expr):
         ob = self.eval(expr.object)
-        if not isinstance(ob, LoxInstance):
+        if type(ob) is not LoxInstance:
             raise RuntimeError(expr.name, "can only set properties on instances")
         value = self.eval(expr.value)
-        ob.set(expr.name, value)
+        if ob.shape is expr.shape:
+            slot, shape = expr.entry
+        else:
+            slot, shape = set_entry(expr, ob, expr.name)
+        if shape is None:
+            ob.values[slot] = value
+        else:
+            ob.values.append(value)
+            ob.shape = shape
         return value
 
     def visit_super(self, expr):
-        distance = self.locals.get(expr)
-        superclass = self.env.get_at(distance, "super")
-        ob = self.env.get_at(distance - 1, "this")
+        superclass = self.frame[expr.slot].value
+        ob = self.lookup_variable(expr.keyword, expr.this)
         method = superclass.find_method(expr.method.lexeme)
         if method is None:
             raise RuntimeError(expr.method, f"undefined property {expr.method.lexeme}")
@@ -119,9 +245,17 @@ class Interpreter:
 
     def visit_binary(self, expr):
         left = self.eval(expr.left)
-        op = expr.operator
         right = self.eval(expr.right)
+        if expr.deopts < DEOPT_LIMIT:
+            op = expr.operator.type
+            quick = QUICK_BINARY.get(op) or QUICK_BINARY.get(
+                (op, type(left), type(right))
+            )
+            if quick is not None:
+                expr.__class__ = quick
+        return self.binary(expr.operator, left, right)
 
+    def binary(self, op, left, right):
         match op.type:
             case Tt.PLUS:
                 if type(left) is float and type(right) is float:
@@ -131,7 +265,7 @@ class Interpreter:
                 else:
                     raise RuntimeError(
                         op,
-                        f"can only add numbers or strings, adding {left.literal} and {right.literal}",
+                        f"can only add numbers or strings, adding {self.stringify(left)} and {self.stringify(right)}",
                     )
             case Tt.MINUS:
                 self.raise_if_not_numbers(op, left, right)
@@ -161,85 +295,211 @@ class Interpreter:
             case Tt.EQUAL_EQUAL:
                 return self.is_equal(left, right)
 
+    # Specialized handlers for sites that have only seen operands of one type.
+    # If the guard fails, the site goes back to the generic handler.
+
+    def visit_add_float(self, expr):
+        left = self.eval(expr.left)
+        right = self.eval(expr.right)
+        if type(left) is float and type(right) is float:
+            return left + right
+        return self.deoptimize(expr, left, right)
+
+    def visit_add_str(self, expr):
+        left = self.eval(expr.left)
+        right = self.eval(expr.right)
+        if type(left) is str and type(right) is str:
+            return left + right
+        return self.deoptimize(expr, left, right)
+
+    def visit_subtract_float(self, expr):
+        left = self.eval(expr.left)
+        right = self.eval(expr.right)
+        if type(left) is float and type(right) is float:
+            return left - right
+        return self.deoptimize(expr, left, right)
+
+    def visit_multiply_float(self, expr):
+        left = self.eval(expr.left)
+        right = self.eval(expr.right)
+        if type(left) is float and type(right) is float:
+            return left * right
+        return self.deoptimize(expr, left, right)
+
+    def visit_divide_float(self, expr):
+        left = self.eval(expr.left)
+        right = self.eval(expr.right)
+        if type(left) is float and type(right) is float:
+            if right == 0.0:
+                raise RuntimeError(expr.operator, "Division by 0")
+            return left / right
+        return self.deoptimize(expr, left, right)
+
+    def visit_greater_float(self, expr):
+        left = self.eval(expr.left)
+        right = self.eval(expr.right)
+        if type(left) is float and type(right) is float:
+            return left > right
+        return self.deoptimize(expr, left, right)
+
+    def visit_greater_equal_float(self, expr):
+        left = self.eval(expr.left)
+        right = self.eval(expr.right)
+        if type(left) is float and type(right) is float:
+            return left >= right
+        return self.deoptimize(expr, left, right)
+
+    def visit_less_float(self, expr):
+        left = self.eval(expr.left)
+        right = self.eval(expr.right)
+        if type(left) is float and type(right) is float:
+            return left < right
+        return self.deoptimize(expr, left, right)
+
+    def visit_less_equal_float(self, expr):
+        left = self.eval(expr.left)
+        right = self.eval(expr.right)
+        if type(left) is float and type(right) is float:
+            return left <= right
+        return self.deoptimize(expr, left, right)
+
+    def visit_equal(self, expr):
+        return self.eval(expr.left) == self.eval(expr.right)
+
+    def visit_not_equal(self, expr):
+        return self.eval(expr.left) != self.eval(expr.right)
+
+    def deoptimize(self, expr, left, right):
+        expr.__class__ = Binary
+        expr.deopts += 1
+        return self.binary(expr.operator, left, right)
+
     def visit_assign(self, expr):
         value = self.eval(expr.value)
-        distance = self.locals.get(expr)
-        if distance is not None:
-            self.env.assign_at(distance, expr.name.lexeme, value)
-        else:
+        if expr.slot is None:
             self.g.assign(expr.name, value)
+        elif expr.cell:
+            self.frame[expr.slot].value = value
+        else:
+            self.frame[expr.slot] = value
         return value
 
     def eval(self, expr):
-        return expr.accept(self)
+        return self.handlers[expr.__class__](expr)
 
-    def eval_block(self, statements, env):
-        prev = self.env
+    # Statements return None, or a 1-tuple holding the value of an executed
+    # return statement, which each enclosing statement passes on until it
+    # reaches the function call
+    def eval_block(self, statements, frame):
+        prev = self.frame
         try:
-            self.env = env
+            self.frame = frame
             for statement in statements:
-                self.eval(statement)
+                result = self.handlers[statement.__class__](statement)
+                if result is not None:
+                    return result
         finally:
-            self.env = prev
-
-    def resolve(self, expr, depth):
-        self.locals[expr] = depth
+            self.frame = prev
 
     def visit_print(self, stmt):
         value = self.eval(stmt.expr)
         print(self.stringify(value))
 
     def visit_block(self, stmt):
-        self.eval_block(stmt.statements, Env(self.env))
+        for statement in stmt.statements:
+            result = self.handlers[statement.__class__](statement)
+            if result is not None:
+                return result
 
     def visit_class(self, stmt):
-        self.env.define(stmt.name.lexeme, None)
         superclass = None
         if stmt.superclass is not None:
             superclass = self.eval(stmt.superclass)
             if not isinstance(superclass, LoxClass):
                 raise RuntimeError(stmt.superclass.name, "superclass must be a class")
-            self.env = Env(self.env)
-            self.env.define("super", superclass)
+            if stmt.super_slot is not None:
+                self.frame[stmt.super_slot] = Cell(superclass)
+        if stmt.cell:
+            # Methods that refer to the class capture its cell
+            cell = self.frame[stmt.slot] = Cell(None)
 
         methods = {}
         for method in stmt.methods:
-            fun = Fun(method, self.env, method.name.lexeme == "init")
+            fun = make_fun(method, self.captured(method), method.name.lexeme == "init")
             methods[method.name.lexeme] = fun
         c = LoxClass(stmt.name.lexeme, superclass, methods)
-        if superclass is not None:
-            self.env = self.env.enclosing
-        self.env.assign(stmt.name, c)
+        if stmt.cell:
+            cell.value = c
+        else:
+            # Methods only look the class up when called, so it can be defined
+            # last
+            self.define(stmt, c)
 
     def visit_if(self, stmt):
         if self.is_truthy(self.eval(stmt.condition)):
-            self.eval(stmt.thenbranch)
+            return self.eval(stmt.thenbranch)
         elif stmt.elsebranch is not None:
-            self.eval(stmt.elsebranch)
+            return self.eval(stmt.elsebranch)
 
     def visit_while(self, stmt):
-        while self.is_truthy(self.eval(stmt.condition)):
-            self.eval(stmt.body)
+        condition = stmt.condition
+        if condition.__class__ is Literal and self.is_truthy(condition.value):
+            # for (;;) and while (true) don't need to check the condition
+            while True:
+                result = self.eval(stmt.body)
+                if result is not None:
+                    return result
+        while self.is_truthy(self.eval(condition)):
+            result = self.eval(stmt.body)
+            if result is not None:
+                return result
 
     def visit_return(self, stmt):
         value = None
-        if stmt.value:
+        if stmt.value is not None:
             value = self.eval(stmt.value)
-        raise ReturnError(value)
-
-        value = None
+        return (value,)
 
     def visit_var(self, stmt):
+        value = None
         if stmt.initializer is not None:
             value = self.eval(stmt.initializer)
-        self.env.define(stmt.name.lexeme, value)
+        self.define(stmt, value)
 
     def visit_expression(self, stmt):
         self.eval(stmt.expr)
 
     def visit_function(self, stmt):
-        fun = Fun(stmt, self.env, False)
-        self.env.define(stmt.name.lexeme, fun)
+        if stmt.cell:
+            # A function that refers to itself captures its own cell
+            cell = self.frame[stmt.slot] = Cell(None)
+            cell.value = make_fun(stmt, self.captured(stmt), False)
+        else:
+            self.define(stmt, make_fun(stmt, self.captured(stmt), False))
+
+    # Describes the state each Binary and Unary site in statements was left in
+    def quickening_stats(self, statements):
+        sites = [
+            node for node in walk(statements) if isinstance(node, (Binary, Unary))
+        ]
+        kinds = {}
+        lines = []
+        for site in sites:
+            kind = getattr(site.__class__, "kind", None)
+            if kind is None:
+                if site.deopts >= DEOPT_LIMIT:
+                    kind = "generic"
+                elif site.deopts:
+                    kind = "deoptimized"
+                else:
+                    kind = "unspecialized"
+            kinds[kind] = kinds.get(kind, 0) + 1
+            line = f"  line {site.operator.line}: {site.operator.lexeme} {kind}"
+            if site.deopts:
+                line += f", deopts: {site.deopts}"
+            lines.append(line)
+        summary = ", ".join(f"{count} {kind}" for kind, count in sorted(kinds.items()))
+        return [f"quickening: {len(sites)} sites ({summary})", *lines]
 
     def interpret(self, statements):
         try:
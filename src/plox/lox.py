@@ -1,23 +1,164 @@
+import mmap
+import os
 import sys
+import time
+from contextlib import contextmanager
+from itertools import chain
 
+from .cache import Cache
+from .closure_compiler import ClosureInterpreter
+from .errors import ParseError
 from .interpreter import Interpreter
+from .nodes import count_nodes
+from .optimizer import Optimizer
 from .parser import Parser
 from .resolver import Resolver
-from .tokenizer import Tokenizer
+from .stmt import Function
+from .tokenizer import (
+    BufferTokenizer,
+    FastTokenizer,
+    MmapTokenizer,
+    Token,
+    Tokenizer,
+    Tt,
+)
+from .trampoline import TrampolineInterpreter
+from .transpiler import PythonEngine, Transpiler
+from .vm import VM
+from .watch import INTERVAL, Watcher
+
+# Execution backends, selectable with --engine
+ENGINES = {
+    "tree": Interpreter,
+    "closure": ClosureInterpreter,
+    "vm": VM,
+    "python": PythonEngine,
+    "trampoline": TrampolineInterpreter,
+}
+
+# Tokenizers, selectable with --tokenizer. All produce the same tokens.
+TOKENIZERS = {
+    "fast": FastTokenizer,
+    "scan": Tokenizer,
+    "buffer": BufferTokenizer,
+    "mmap": MmapTokenizer,
+}
+
+# Passes run in order over the resolved AST before it is executed. Each is
+# created with the Lox instance, and its run method returns the rewritten
+# statements.
+PASSES = [Optimizer]
+
+# Default for the deepest the engines that keep their own call stack let Lox
+# calls nest, see --max-depth
+MAX_DEPTH = 100000
+
+
+# The bytes of file, mapped into memory rather than read
+@contextmanager
+def mapped(file):
+    with open(file, "rb") as f:
+        # Empty files can't be mapped
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as source:
+            yield source
 
 
 class Lox:
-    def __init__(self):
+    def __init__(
+        self,
+        engine="tree",
+        passes=PASSES,
+        stats=False,
+        max_depth=MAX_DEPTH,
+        tokenizer="fast",
+        cache_dir=None,
+        lazy=False,
+    ):
         self.had_error = False
         self.had_runtime_error = False
-        self.interpreter = Interpreter(self)
+        self.passes = passes
+        # Print statistics to stderr
+        self.stats = stats
+        self.max_depth = max_depth
+        self.tokenizer = TOKENIZERS[tokenizer]
+        # Parse function bodies when they are first called, see LazyFunction.
+        # The parser and resolver for the bodies are made on the first call.
+        self.lazy = lazy
+        self.body_parser = None
+        self.body_resolver = None
+        # Scripts are compiled once and then loaded from cache_dir, unless it
+        # is None. --stats reports what the passes did, so it always compiles,
+        # and lazy functions can't be cached.
+        self.cache = None
+        if cache_dir is not None and not stats and not lazy:
+            self.cache = Cache(cache_dir, passes)
+        self.engine = ENGINES[engine]
+        self.interpreter = self.engine(self)
 
     def run_file(self, file):
-        with open(file, encoding="utf-8") as f:
-            self.run(f.read())
+        if self.tokenizer is MmapTokenizer:
+            with mapped(file) as source:
+                self.run(source, cached=True)
+        else:
+            with open(file, encoding="utf-8") as f:
+                self.run(f.read(), cached=True)
+        if self.had_error:
+            sys.exit(65)
+
+    # Runs each top-level declaration as soon as it has been parsed, reading
+    # the file as the parser needs more tokens, so neither the source nor the
+    # program is ever held in memory as a whole. Declarations before a static
+    # error still run; after one, the rest is only parsed, to report errors.
+    def run_stream(self, file):
+        if self.tokenizer is MmapTokenizer:
+            with mapped(file) as source:
+                self.run_tokens(MmapTokenizer(self, source).tokens())
+        else:
+            with open(file, encoding="utf-8") as f:
+                self.run_tokens(FastTokenizer(self, f).tokens())
         if self.had_error:
             sys.exit(65)
 
+    def run_tokens(self, tokens):
+        for statement in Parser(self, tokens).parse():
+            if self.had_error or self.had_runtime_error:
+                continue
+            statements = self.resolve([statement])
+            if statements is not None:
+                self.execute(statements)
+
+    # Runs file, then runs it again each time it changes, until interrupted.
+    # Each run starts with fresh globals, and only compiles the top-level
+    # declarations that changed, see Watcher.
+    def watch(self, file):
+        watcher = Watcher(self)
+        stamp = None
+        try:
+            while True:
+                source = None
+                try:
+                    stat = os.stat(file)
+                    if (stat.st_mtime_ns, stat.st_size) != stamp:
+                        with open(file, encoding="utf-8") as f:
+                            source = f.read()
+                        stamp = (stat.st_mtime_ns, stat.st_size)
+                except OSError:
+                    # Editors can remove a file before writing it again
+                    pass
+                if source is not None:
+                    self.had_error = False
+                    self.had_runtime_error = False
+                    self.interpreter = self.engine(self)
+                    statements = watcher.compile(source)
+                    if statements is not None:
+                        self.run_statements(statements)
+                time.sleep(INTERVAL)
+        except KeyboardInterrupt:
+            pass
+
     def run_prompt(self):
         while True:
             print(">")
@@ -27,19 +168,105 @@ class Lox:
             self.had_runtime_error = False
 
 
-    def run(self, s):
-        tokens = Tokenizer(self, s).tokenize()
+    def emit_python(self, file):
+        with open(file, encoding="utf-8") as f:
+            statements = self.analyze(f.read())
+        if self.had_error:
+            sys.exit(65)
+        try:
+            source = Transpiler(file).transpile(statements)
+        except ParseError:
+            # The errors in a lazy function have been reported
+            sys.exit(65)
+        print(source, end="")
+
+    def run(self, s, cached=False):
+        if cached and self.cache is not None:
+            statements = self.analyze_cached(s)
+        else:
+            statements = self.analyze(s)
+        if statements is not None:
+            self.run_statements(statements)
+
+    def run_statements(self, statements):
+        self.execute(statements)
+        if self.stats and hasattr(self.interpreter, "quickening_stats"):
+            for line in self.interpreter.quickening_stats(statements):
+                print(line, file=sys.stderr)
+
+    def execute(self, statements):
+        try:
+            self.interpreter.interpret(statements)
+        except ParseError:
+            # A lazy function had static errors when it was parsed, which
+            # have been reported
+            pass
+
+    # Parses and resolves s, returning None if there were static errors
+    def analyze(self, s):
+        tokens = self.tokenizer(self, s).tokenize()
         parser = Parser(self, tokens)
-        statements = parser.parse()
+        statements = list(parser.parse())
         if self.had_error:
-            return
+            return None
         if self.had_runtime_error:
             sys.exit(70)
-        resolver = Resolver(self, self.interpreter)
-        resolver.resolve_statements(statements)
+        return self.resolve(statements)
+
+    # Like analyze, but loads the statements from the cache if s has been
+    # compiled before, and stores them there if not
+    def analyze_cached(self, s):
+        key = self.cache.key(s.encode() if type(s) is str else s)
+        statements = self.cache.load(key)
+        if statements is None:
+            statements = self.analyze(s)
+            if statements is not None:
+                self.cache.store(key, statements)
+        return statements
+
+    # Resolves statements and runs the passes over them, returning None if
+    # there were static errors
+    def resolve(self, statements):
+        Resolver(self).resolve_statements(statements)
         if self.had_error:
-            return
-        self.interpreter.interpret(statements)
+            return None
+        return self.optimize(statements)
+
+    # Runs the passes over statements. passes can be instances of them to use
+    # instead of new ones, to carry on from earlier statements.
+    def optimize(self, statements, passes=None):
+        if passes is None:
+            passes = [cls(self) for cls in self.passes]
+        for p in passes:
+            before = count_nodes(statements) if self.stats else 0
+            statements = p.run(statements)
+            if self.stats:
+                removed = before - count_nodes(statements)
+                print(
+                    f"{p.__class__.__name__}: removed {removed} of {before} nodes",
+                    file=sys.stderr,
+                )
+        return statements
+
+    # Parses, resolves and optimizes the body of a LazyFunction, the first time
+    # anything needs it, which makes function a plain Function. Static errors
+    # in the body are reported like any other, and stop the program.
+    def parse_body(self, function, lazy):
+        tokens = lazy.tokens
+        end = Token(Tt.EOF, "", None, tokens[-1].line)
+        if self.body_parser is None:
+            self.body_parser = Parser(self, [end])
+            self.body_resolver = Resolver(self)
+        self.body_parser.feed(chain(tokens, [end]))
+        body = self.body_parser.block()
+        if not self.had_error:
+            self.body_resolver.resolve_body(function, body, lazy)
+        if self.had_error:
+            raise ParseError()
+        body = self.optimize(body)
+        Function.body.__set__(function, body)
+        function.__class__ = Function
+        return body
 
     def error(self, line, s):
         self.had_error = True
@@ -47,4 +274,4 @@ class Lox:
 
     def runtime_error(self, error):
         self.had_runtime_error = True
-        print(f"Runtime error at line {error.token.line}: {error}")
+        print(f"Runtime error at line {error.line}: {error}")
@@ -0,0 +1,71 @@
+# Builds an AST node class named name, with the given fields as positional
+# __init__ parameters. Keyword arguments add further attributes with a default
+# value, which passes fill in later. Nodes use __slots__, and the name of the
+# visitor method is worked out once per class rather than on every accept.
+def make_node(base, name, *fields, **defaults):
+    attributes = fields + tuple(defaults)
+    lines = [f"    self.{field} = {field}" for field in fields]
+    lines += [f"    self.{key} = {value!r}" for key, value in defaults.items()]
+    source = f"def __init__(self, {', '.join(fields)}):\n" + "\n".join(lines or ["    pass"])
+    # Pickle the attributes as a plain tuple, which is much smaller and quicker
+    # to load than the default dict of slot names
+    values = "".join(f"self.{attribute}, " for attribute in attributes)
+    source += f"\ndef __getstate__(self):\n    return ({values})"
+    source += f"\ndef __setstate__(self, state):\n    {values or '()'}= state"
+    namespace = {}
+    exec(source, namespace)
+    handler = f"visit_{name.lower()}"
+
+    def accept(self, visitor):
+        return getattr(visitor, handler)(self)
+
+    return type(
+        name,
+        (base,),
+        {
+            "__slots__": attributes,
+            # So pickle finds the class in the module that made it
+            "__module__": base.__module__,
+            "__init__": namespace["__init__"],
+            "__getstate__": namespace["__getstate__"],
+            "__setstate__": namespace["__setstate__"],
+            "accept": accept,
+            "fields": fields,
+            "handler": handler,
+        },
+    )
+
+
+# Yields every node in a tree, or in a list of trees, parents first
+def walk(node):
+    if type(node) is list:
+        for item in node:
+            yield from walk(item)
+        return
+    fields = getattr(node.__class__, "fields", None)
+    if fields is None:
+        return
+    yield node
+    for field in fields:
+        yield from walk(getattr(node, field))
+
+
+def count_nodes(node):
+    return sum(1 for _ in walk(node))
+
+
+class Handlers(dict):
+    def __init__(self, visitor):
+        self.visitor = visitor
+
+    def __missing__(self, cls):
+        handler = self[cls] = getattr(self.visitor, cls.handler)
+        return handler
+
+
+# Base for visitors on hot paths: instead of going through accept, which has to
+# look up the handler by name each time, the bound handler for each node class
+# is looked up once and cached in self.handlers
+class Visitor:
+    def __init__(self):
+        self.handlers = Handlers(self)
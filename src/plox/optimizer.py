@@ -0,0 +1,211 @@
+from .expr import Literal
+from .nodes import Visitor
+from .stmt import Block, LazyFunction
+from .tokenizer import Tt
+
+# Binary operators that only apply to two numbers
+NUMERIC = {
+    Tt.MINUS: lambda a, b: a - b,
+    Tt.STAR: lambda a, b: a * b,
+    Tt.SLASH: lambda a, b: a / b,
+    Tt.GREATER: lambda a, b: a > b,
+    Tt.GREATER_EQUAL: lambda a, b: a >= b,
+    Tt.LESS: lambda a, b: a < b,
+    Tt.LESS_EQUAL: lambda a, b: a <= b,
+}
+
+
+def is_truthy(value):
+    return value is not None and value is not False
+
+
+# Rewrites the resolved AST before it runs: folds operators applied to
+# literals, drops branches that can never run and groupings, and replaces reads
+# of local variables that are never assigned with the literal they were
+# initialized to. Anything that would raise a runtime error is left as it is,
+# so the error still happens when it runs, at the same line.
+class Optimizer(Visitor):
+    def __init__(self, lox):
+        super().__init__()
+        self.lox = lox
+        # Per function, the Var statement that last declared a variable in
+        # each frame slot, or None for other declarations. Slots are reused
+        # once a block ends, but by then nothing refers to its variables.
+        self.frames = [{}]
+
+    def run(self, statements):
+        return self.statements(statements)
+
+    def optimize(self, node):
+        return self.handlers[node.__class__](node)
+
+    # Statements return their replacement, or None if they can be removed
+    def statements(self, statements):
+        result = []
+        for statement in statements:
+            statement = self.optimize(statement)
+            if statement is not None:
+                result.append(statement)
+        return result
+
+    def branch(self, stmt):
+        stmt = self.optimize(stmt)
+        return Block([]) if stmt is None else stmt
+
+    def declare(self, stmt, var):
+        if stmt.slot is not None:
+            self.frames[-1][stmt.slot] = var
+
+    def function(self, stmt):
+        # Lazy bodies are optimized once they have been parsed
+        if stmt.__class__ is LazyFunction:
+            return
+        self.frames.append({})
+        stmt.body = self.statements(stmt.body)
+        self.frames.pop()
+
+    def visit_block(self, stmt):
+        stmt.statements = self.statements(stmt.statements)
+        return stmt
+
+    def visit_class(self, stmt):
+        self.declare(stmt, None)
+        for method in stmt.methods:
+            self.function(method)
+        return stmt
+
+    def visit_expression(self, stmt):
+        stmt.expr = self.optimize(stmt.expr)
+        if stmt.expr.__class__ is Literal:
+            return None
+        return stmt
+
+    def visit_function(self, stmt):
+        self.declare(stmt, None)
+        self.function(stmt)
+        return stmt
+
+    def visit_if(self, stmt):
+        condition = self.optimize(stmt.condition)
+        if condition.__class__ is Literal:
+            if is_truthy(condition.value):
+                return self.optimize(stmt.thenbranch)
+            if stmt.elsebranch is not None:
+                return self.optimize(stmt.elsebranch)
+            return None
+        stmt.condition = condition
+        stmt.thenbranch = self.branch(stmt.thenbranch)
+        if stmt.elsebranch is not None:
+            stmt.elsebranch = self.optimize(stmt.elsebranch)
+        return stmt
+
+    def visit_print(self, stmt):
+        stmt.expr = self.optimize(stmt.expr)
+        return stmt
+
+    def visit_return(self, stmt):
+        if stmt.value is not None:
+            stmt.value = self.optimize(stmt.value)
+        return stmt
+
+    def visit_var(self, stmt):
+        if stmt.initializer is not None:
+            stmt.initializer = self.optimize(stmt.initializer)
+        self.declare(stmt, stmt)
+        return stmt
+
+    def visit_while(self, stmt):
+        condition = self.optimize(stmt.condition)
+        if condition.__class__ is Literal and not is_truthy(condition.value):
+            return None
+        stmt.condition = condition
+        stmt.body = self.branch(stmt.body)
+        return stmt
+
+    def visit_assign(self, expr):
+        expr.value = self.optimize(expr.value)
+        return expr
+
+    def visit_binary(self, expr):
+        left = expr.left = self.optimize(expr.left)
+        right = expr.right = self.optimize(expr.right)
+        if left.__class__ is not Literal or right.__class__ is not Literal:
+            return expr
+        a, b = left.value, right.value
+        op = expr.operator.type
+        if op in NUMERIC:
+            if type(a) is not float or type(b) is not float:
+                return expr
+            if op == Tt.SLASH and b == 0.0:
+                return expr
+            return Literal(NUMERIC[op](a, b))
+        if op == Tt.PLUS:
+            if type(a) is type(b) and type(a) in (float, str):
+                return Literal(a + b)
+            return expr
+        # Engines may compare values of different types differently, so only
+        # fold equality between values of the same type, or with nil
+        if type(a) is type(b) or a is None or b is None:
+            if op == Tt.EQUAL_EQUAL:
+                return Literal(a == b)
+            if op == Tt.BANG_EQUAL:
+                return Literal(a != b)
+        return expr
+
+    def visit_call(self, expr):
+        expr.callee = self.optimize(expr.callee)
+        expr.arguments = [self.optimize(arg) for arg in expr.arguments]
+        return expr
+
+    def visit_get(self, expr):
+        expr.object = self.optimize(expr.object)
+        return expr
+
+    def visit_grouping(self, expr):
+        return self.optimize(expr.expression)
+
+    def visit_literal(self, expr):
+        return expr
+
+    def visit_logical(self, expr):
+        left = expr.left = self.optimize(expr.left)
+        if left.__class__ is Literal:
+            if is_truthy(left.value) == (expr.operator.type == Tt.OR):
+                return left
+            return self.optimize(expr.right)
+        expr.right = self.optimize(expr.right)
+        return expr
+
+    def visit_set(self, expr):
+        expr.object = self.optimize(expr.object)
+        expr.value = self.optimize(expr.value)
+        return expr
+
+    def visit_super(self, expr):
+        return expr
+
+    def visit_this(self, expr):
+        return expr
+
+    def visit_unary(self, expr):
+        right = expr.right = self.optimize(expr.right)
+        if right.__class__ is not Literal:
+            return expr
+        if expr.operator.type == Tt.BANG:
+            return Literal(not is_truthy(right.value))
+        if type(right.value) is float:
+            return Literal(-right.value)
+        return expr
+
+    def visit_variable(self, expr):
+        # Captured variables are left alone
+        if expr.slot is None or expr.cell:
+            return expr
+        var = self.frames[-1].get(expr.slot)
+        if var is None or var.assigned:
+            return expr
+        if var.initializer is None:
+            return Literal(None)
+        if var.initializer.__class__ is Literal:
+            return Literal(var.initializer.value)
+        return expr
@@ -13,15 +13,50 @@ from .expr import (
     Unary,
     Variable,
 )
-from .stmt import Block, Class, Expression, Function, If, Print, Return, Var, While
+from .stmt import (
+    Block,
+    Class,
+    Expression,
+    Function,
+    If,
+    LazyFunction,
+    Print,
+    Return,
+    Var,
+    While,
+)
 from .tokenizer import Tt
 
+# How tightly each kind of operator binds, from loosest to tightest
+ASSIGNMENT, OR, AND, EQUALITY, COMPARISON, TERM, FACTOR, UNARY, CALL = range(1, 10)
 
-class Parser:
+CONSTANTS = {Tt.FALSE: False, Tt.TRUE: True, Tt.NIL: None}
+
+
+# The body of a LazyFunction: its tokens, up to and including the closing },
+# and what resolving it needs, which the resolver fills in as scope
+class LazyBody:
     def __init__(self, lox, tokens):
         self.lox = lox
         self.tokens = tokens
-        self.current = 0
+        self.scope = None
+
+
+class Parser:
+    def __init__(self, lox, tokens):
+        self.lox = lox
+        # Skip over function bodies, leaving them to be parsed when they are
+        # first called
+        self.lazy = lox.lazy
+        self.feed(tokens)
+
+    # Only the current and the previous token are kept, so tokens can be any
+    # iterable ending with EOF, including a generator. Feeding the parser new
+    # tokens lets it be reused.
+    def feed(self, tokens):
+        self.tokens = iter(tokens)
+        self.token = next(self.tokens)
+        self.previous = None
 
     def match(self, *types):
         for t in types:
@@ -65,20 +100,21 @@ class Parser:
 
     def advance(self):
         if not self.is_at_end():
-            self.current += 1
-        return self.prev()
+            self.previous = self.token
+            self.token = next(self.tokens)
+        return self.previous
 
     def is_at_end(self):
         return self.peek().type == Tt.EOF
 
     def peek(self):
-        return self.tokens[self.current]
+        return self.token
 
     def prev(self):
-        return self.tokens[self.current - 1]
+        return self.previous
 
     def expression(self):
-        return self.assignment()
+        return self.precedence(ASSIGNMENT)
 
     def declaration(self):
         try:
@@ -106,6 +142,31 @@ class Parser:
         return Class(name, superclass, methods)
 
     def fun_declaration(self, kind):
+        name, params = self.signature(kind)
+        if self.lazy:
+            return LazyFunction(name, params, self.skip_body())
+        return Function(name, params, self.block())
+
+    # Skips a function's body, only looking at braces to find where it ends
+    def skip_body(self):
+        tokens = []
+        depth = 1
+        token = self.token
+        while token.type != Tt.EOF:
+            if token.type == Tt.LEFT_BRACE:
+                depth += 1
+            elif token.type == Tt.RIGHT_BRACE:
+                depth -= 1
+                if depth == 0:
+                    break
+            tokens.append(token)
+            token = next(self.tokens)
+        self.token = token
+        tokens.append(self.consume(Tt.RIGHT_BRACE, "Right brace expected after block."))
+        return LazyBody(self.lox, tokens)
+
+    # Parses a function's name and parameters, and the { starting its body
+    def signature(self, kind):
         name = self.consume(Tt.IDENTIFIER, f"expected {kind} name")
         self.consume(
             Tt.LEFT_PAREN, "( expected at the beginning of function definition"
@@ -124,10 +185,7 @@ class Parser:
         self.consume(
             Tt.LEFT_BRACE, "{ expected at the beginning of function definition"
         )
-
-        body = self.block()
-
-        return Function(name, params, body)
+        return name, params
 
     def var_declaration(self):
         name = self.consume(Tt.IDENTIFIER, "expect a variable name")
@@ -225,93 +283,51 @@ class Parser:
         self.consume(Tt.SEMI, "expect semi after statement")
         return Expression(value)
 
-    def assignment(self):
-        expr = self.or_op()
-        if self.match(Tt.EQUAL):
-            equals = self.prev()
-            value = self.assignment()
-            if type(expr) is Variable:
-                name = expr.name
-                return Assign(name, value)
-            elif type(expr) is Get:
-                get = expr
-                return Set(get.object, get.name, value)
-            self.lox.error(equals.line, "Invalid assignment target")
-
-        return expr
-
-    def or_op(self):
-        expr = self.and_op()
-        while self.match(Tt.OR):
-            op = self.prev()
-            right = self.and_op()
-            expr = Logical(expr, op, right)
-        return expr
-
-    def and_op(self):
-        expr = self.equality()
-        while self.match(Tt.AND):
-            op = self.prev()
-            right = self.equality()
-            expr = Logical(expr, op, right)
-        return expr
-
-    def equality(self):
-        expr = self.comparison()
-        while self.match(Tt.BANG_EQUAL, Tt.EQUAL_EQUAL):
-            operator = self.prev()
-            right = self.comparison()
-            expr = Binary(expr, operator, right)
-        return expr
-
-    def comparison(self):
-        expr = self.term()
-        while self.match(Tt.GREATER, Tt.GREATER_EQUAL, Tt.LESS, Tt.LESS_EQUAL):
-            operator = self.prev()
-            right = self.term()
-            expr = Binary(expr, operator, right)
-
-        return expr
-
-    def term(self):
-        expr = self.factor()
-        while self.match(Tt.MINUS, Tt.PLUS):
-            operator = self.prev()
-            right = self.factor()
-            expr = Binary(expr, operator, right)
-
-        return expr
-
-    def factor(self):
-        expr = self.unary()
-        while self.match(Tt.SLASH, Tt.STAR):
-            operator = self.prev()
-            right = self.unary()
-            expr = Binary(expr, operator, right)
-
-        return expr
-
-    def unary(self):
-        if self.match(Tt.BANG, Tt.MINUS):
-            operator = self.prev()
-            right = self.unary()
-            return Unary(operator, right)
-
-        return self.call()
-
-    def call(self):
-        expr = self.primary()
-
+    # Parses an expression whose operators all bind at least as tightly as
+    # level. Each token's prefix handler parses the operand it starts, and
+    # infix handlers then extend it for as long as the next token is an
+    # operator binding tightly enough.
+    def precedence(self, level):
+        token = self.token
+        prefix = PREFIX.get(token.type)
+        if prefix is None:
+            raise self.error(token, "expected expression")
+        self.previous = token
+        self.token = next(self.tokens)
+        expr = prefix(self, token)
         while True:
-            if self.match(Tt.LEFT_PAREN):
-                expr = self.finish_call(expr)
-            elif self.match(Tt.DOT):
-                name = self.consume(Tt.IDENTIFIER, "property name expected after .")
-                expr = Get(expr, name)
-            else:
-                break
-
-        return expr
+            token = self.token
+            rule = INFIX.get(token.type)
+            if rule is None or rule[0] < level:
+                return expr
+            self.previous = token
+            self.token = next(self.tokens)
+            expr = rule[1](self, expr, token)
+
+    def assignment(self, target, equals):
+        value = self.precedence(ASSIGNMENT)
+        if type(target) is Variable:
+            return Assign(target.name, value)
+        elif type(target) is Get:
+            return Set(target.object, target.name, value)
+        self.lox.error(equals.line, "Invalid assignment target")
+        return target
+
+    def logical(self, left, operator):
+        return Logical(left, operator, self.precedence(INFIX[operator.type][0] + 1))
+
+    def binary(self, left, operator):
+        return Binary(left, operator, self.precedence(INFIX[operator.type][0] + 1))
+
+    def unary(self, operator):
+        return Unary(operator, self.precedence(UNARY))
+
+    def call(self, callee, paren):
+        return self.finish_call(callee)
+
+    def get(self, ob, dot):
+        name = self.consume(Tt.IDENTIFIER, "property name expected after .")
+        return Get(ob, name)
 
     def finish_call(self, callee):
         args = []
@@ -325,37 +341,67 @@ class Parser:
         paren = self.consume(Tt.RIGHT_PAREN, ") expected after argument list")
         return Call(callee, paren, args)
 
-    def primary(self):
-        if self.match(Tt.FALSE):
-            return Literal(False)
-        if self.match(Tt.TRUE):
-            return Literal(True)
-        if self.match(Tt.NIL):
-            return Literal(None)
+    def literal(self, token):
+        return Literal(token.literal)
 
-        if self.match(Tt.NUMBER, Tt.STRING):
-            return Literal(self.prev().literal)
+    def constant(self, token):
+        return Literal(CONSTANTS[token.type])
 
-        if self.match(Tt.SUPER):
-            keyword = self.prev()
-            self.consume(Tt.DOT, ". expected after super")
-            method = self.consume(Tt.IDENTIFIER, "superclass name expected")
-            return Super(keyword, method)
+    def super_method(self, keyword):
+        self.consume(Tt.DOT, ". expected after super")
+        method = self.consume(Tt.IDENTIFIER, "superclass name expected")
+        return Super(keyword, method)
 
-        if self.match(Tt.THIS):
-            return This(self.prev())
+    def this(self, keyword):
+        return This(keyword)
 
-        if self.match(Tt.IDENTIFIER):
-            return Variable(self.prev())
+    def variable(self, name):
+        return Variable(name)
 
-        if self.match(Tt.LEFT_PAREN):
-            expr = self.expression()
-            self.consume(Tt.RIGHT_PAREN, "right paren expected after expression.")
-            return Grouping(expr)
-        raise self.error(self.peek(), "expected expression")
+    def grouping(self, paren):
+        expr = self.expression()
+        self.consume(Tt.RIGHT_PAREN, "right paren expected after expression.")
+        return Grouping(expr)
 
+    # Yields the top-level declarations one at a time, as each one is parsed
     def parse(self):
-        statements = []
         while not self.is_at_end():
-            statements.append(self.declaration())
-        return statements
+            yield self.declaration()
+
+
+# Handlers for the tokens that can start an expression, called with the token
+PREFIX = {
+    Tt.FALSE: Parser.constant,
+    Tt.TRUE: Parser.constant,
+    Tt.NIL: Parser.constant,
+    Tt.NUMBER: Parser.literal,
+    Tt.STRING: Parser.literal,
+    Tt.SUPER: Parser.super_method,
+    Tt.THIS: Parser.this,
+    Tt.IDENTIFIER: Parser.variable,
+    Tt.LEFT_PAREN: Parser.grouping,
+    Tt.BANG: Parser.unary,
+    Tt.MINUS: Parser.unary,
+}
+
+# For the tokens that can follow an operand, how tightly they bind and the
+# handler called with the operand and the token. Binary operators are left
+# associative, so their right operand has to bind more tightly than they do,
+# while assignment is right associative.
+INFIX = {
+    Tt.EQUAL: (ASSIGNMENT, Parser.assignment),
+    Tt.OR: (OR, Parser.logical),
+    Tt.AND: (AND, Parser.logical),
+    Tt.BANG_EQUAL: (EQUALITY, Parser.binary),
+    Tt.EQUAL_EQUAL: (EQUALITY, Parser.binary),
+    Tt.GREATER: (COMPARISON, Parser.binary),
+    Tt.GREATER_EQUAL: (COMPARISON, Parser.binary),
+    Tt.LESS: (COMPARISON, Parser.binary),
+    Tt.LESS_EQUAL: (COMPARISON, Parser.binary),
+    Tt.MINUS: (TERM, Parser.binary),
+    Tt.PLUS: (TERM, Parser.binary),
+    Tt.SLASH: (FACTOR, Parser.binary),
+    Tt.STAR: (FACTOR, Parser.binary),
+    Tt.LEFT_PAREN: (CALL, Parser.call),
+    Tt.DOT: (CALL, Parser.get),
+}
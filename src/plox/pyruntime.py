@@ -0,0 +1,196 @@
+# Run-time support for Python code generated by transpiler.py. Generated
+# modules start with `from plox.pyruntime import *`. Every helper name starts
+# with an underscore and does not end with one, so it can never clash with a
+# (mangled) Lox identifier.
+import time
+from types import FunctionType, MethodType
+
+from .errors import RuntimeError
+from .interpreter import stringify
+
+__all__ = [
+    "_Cell",
+    "_LoxObject",
+    "_add",
+    "_call_error",
+    "_callable",
+    "_div",
+    "_float",
+    "_function",
+    "_instance",
+    "_isinstance",
+    "_method",
+    "_negate",
+    "_not_instance",
+    "_numbers",
+    "_print",
+    "_set",
+    "_setcell",
+    "_setg",
+    "_stringify",
+    "_super_get",
+    "_superclass",
+    "_type",
+    "clock",
+]
+
+_float = float
+_type = type
+_isinstance = isinstance
+_print = print
+_function = FunctionType
+_method = MethodType
+
+
+def lox_name(name):
+    # Inverse of transpiler.mangle
+    return name[:-1] if name.endswith("_") else name
+
+
+class _Cell:
+    # Box for captured variables declared inside loops, which need a fresh
+    # binding on every iteration
+    __slots__ = ("v",)
+
+    def __init__(self, v):
+        self.v = v
+
+
+class LoxClassType(type):
+    def __repr__(cls):
+        return f"<class {cls._name}>"
+
+
+class _LoxObject(metaclass=LoxClassType):
+    _name = ""
+
+    def __repr__(self):
+        return f"<instance {type(self)._name}>"
+
+
+def clock():
+    return time.time()
+
+
+def _stringify(value):
+    if type(value) is FunctionType:
+        return f"<fn {lox_name(value.__name__)}>"
+    if type(value) is MethodType:
+        return f"<fn {lox_name(value.__func__.__name__)}>"
+    return stringify(value)
+
+
+def _numbers(a, b, line):
+    raise RuntimeError(
+        None,
+        f"operands must be numbers, are {_stringify(a)} and {_stringify(b)}",
+        line,
+    )
+
+
+def _add(a, b, line):
+    if type(a) is type(b) and (type(a) is float or type(a) is str):
+        return a + b
+    raise RuntimeError(
+        None,
+        f"can only add numbers or strings, adding {_stringify(a)} and {_stringify(b)}",
+        line,
+    )
+
+
+def _div(a, b, line):
+    if type(a) is not float or type(b) is not float:
+        _numbers(a, b, line)
+    if b == 0.0:
+        raise RuntimeError(None, "Division by 0", line)
+    return a / b
+
+
+def _negate(value, line):
+    raise RuntimeError(
+        None, f"Operand must be a number, is {_stringify(value)}", line
+    )
+
+
+def _not_instance(line):
+    raise RuntimeError(None, "only instances have properties", line)
+
+
+def _instance(value, line):
+    if isinstance(value, _LoxObject):
+        return value
+    raise RuntimeError(None, "can only set properties on instances", line)
+
+
+def _set(instance, name, value):
+    setattr(instance, name, value)
+    return value
+
+
+def _setcell(cell, value):
+    cell.v = value
+    return value
+
+
+def _setg(namespace, name, value, line):
+    if name not in namespace:
+        raise RuntimeError(None, f"Undefined variable {lox_name(name)}", line)
+    namespace[name] = value
+    return value
+
+
+def _superclass(value, line):
+    if type(value) is LoxClassType:
+        return value
+    raise RuntimeError(None, "superclass must be a class", line)
+
+
+def _super_get(superclass, instance, name, line):
+    # Looks through the class dicts rather than using getattr, which would
+    # also find attributes of the metaclass such as mro
+    for klass in superclass.__mro__:
+        if name in klass.__dict__ and klass is not _LoxObject:
+            return MethodType(klass.__dict__[name], instance)
+    raise RuntimeError(None, f"undefined property {lox_name(name)}", line)
+
+
+def _call_error(message, line):
+    # Errors are raised when the returned function is called, so that the
+    # arguments are still evaluated first, like in the tree-walker
+    def fail(*args):
+        raise RuntimeError(None, message, line)
+
+    return fail
+
+
+def _arity(callee):
+    if type(callee) is FunctionType:
+        return callee.__code__.co_argcount
+    if type(callee) is MethodType:
+        return callee.__code__.co_argcount - 1
+    if type(callee) is LoxClassType:
+        init = getattr(callee, "init", None)
+        return 0 if init is None else init.__code__.co_argcount - 1
+    return None
+
+
+def _callable(callee, argc, line):
+    # Slow path of a call: plain functions and bound methods with the right
+    # arity are called directly by the generated code
+    arity = _arity(callee)
+    if arity is None:
+        return _call_error("can only call functions or classes", line)
+    if arity != argc:
+        return _call_error(
+            f"wrong argument count: expected {arity}, got {argc}", line
+        )
+    if type(callee) is LoxClassType:
+
+        def instantiate(*args):
+            instance = object.__new__(callee)
+            if hasattr(callee, "init"):
+                callee.init(instance, *args)
+            return instance
+
+        return instantiate
+    return callee
@@ -1,34 +1,132 @@
-class Resolver:
-    def __init__(self, lox, interpreter):
-        self.lox = lox
-        self.interpreter = interpreter
+from .expr import This
+from .nodes import Visitor
+from .stmt import Function, LazyFunction, Var
+from .tokenizer import Tt
+
+
+# Tokens that may refer to a variable, unless they follow a dot
+REFERENCES = (Tt.IDENTIFIER, Tt.THIS, Tt.SUPER)
+
+
+class Local:
+    def __init__(self, function, slot, declaration):
+        # The FunctionState of the function declaring the variable
+        self.function = function
+        self.slot = slot
+        self.defined = False
+        self.captured = False
+        # The Var, Function or Class statement, or None for parameters, this
+        # and super
+        self.declaration = declaration
+        # Nodes in the declaring function that refer to the variable, which
+        # are switched to its cell if it turns out to be captured
+        self.references = []
+
+
+# Functions keep their locals in a flat frame: a list with a slot for each
+# variable, where variables in blocks that have ended give their slots up for
+# reuse. Variables a nested function refers to are captured: their slot holds
+# a Cell, shared with the closures. A function's own captured cells go at the
+# end of its frame in reverse, so that upvalue j is at slot -1 - j.
+class FunctionState:
+    def __init__(self, enclosing, kind):
+        self.enclosing = enclosing
+        self.kind = kind
         self.scopes = []
-        self.current_function = None
+        self.slots = 0
+        self.frame_size = 0
+        # Slots in the enclosing function's frame of the cells the function
+        # captures, in upvalue order
+        self.captures = []
+
+    # Returns the slot holding the cell for local, which an enclosing
+    # function declares
+    def resolve_upvalue(self, local):
+        if self.enclosing is local.function:
+            local.captured = True
+            return self.add_upvalue(local.slot)
+        return self.add_upvalue(self.enclosing.resolve_upvalue(local))
+
+    def add_upvalue(self, slot):
+        if slot not in self.captures:
+            self.captures.append(slot)
+        return -1 - self.captures.index(slot)
+
+
+class Resolver(Visitor):
+    def __init__(self, lox):
+        super().__init__()
+        self.lox = lox
+        # The top level is resolved like a function, so that variables in its
+        # blocks get slots too
+        self.function = FunctionState(None, None)
         self.current_class = None
+        # For each name, the Locals declaring it that are in scope, innermost
+        # last, so that looking a name up doesn't depend on how deeply scopes
+        # and functions are nested
+        self.symbols = {}
 
     def begin_scope(self):
-        self.scopes.append({})
+        self.function.scopes.append({})
 
     def end_scope(self):
-        self.scopes.pop()
-
-    def declare(self, name):
-        if not self.scopes:
+        function = self.function
+        scope = function.scopes.pop()
+        function.slots -= len(scope)
+        symbols = self.symbols
+        for name, local in scope.items():
+            symbols[name].pop()
+            if local.captured:
+                if local.declaration is not None:
+                    local.declaration.cell = True
+                for node in local.references:
+                    node.cell = True
+        return scope
+
+    def declare(self, name, declaration=None):
+        function = self.function
+        if not function.scopes:
             return
-        scope = self.scopes[-1]
-        if scope.get(name.lexeme):
+        local = function.scopes[-1].get(name.lexeme)
+        if local is not None:
             self.lox.error(name.line, "already a variable with this name in this scope")
-        scope[name.lexeme] = False
+        else:
+            local = self.add_local(name.lexeme, declaration)
+        if declaration is not None:
+            declaration.slot = local.slot
+
+    def add_local(self, name, declaration):
+        function = self.function
+        local = function.scopes[-1][name] = Local(function, function.slots, declaration)
+        self.symbols.setdefault(name, []).append(local)
+        function.slots += 1
+        function.frame_size = max(function.frame_size, function.slots)
+        return local
 
     def define(self, name):
-        if not self.scopes:
+        if not self.function.scopes:
             return
-        self.scopes[-1][name.lexeme] = True
+        self.function.scopes[-1][name.lexeme].defined = True
 
     def resolve_local(self, expr, name):
-        for idx, scope in enumerate(self.scopes[::-1]):
-            if scope.get(name.lexeme):
-                self.interpreter.resolve(expr, idx)
+        # Returns the Local expr refers to, or None for globals
+        declarations = self.symbols.get(name)
+        if not declarations:
+            return None
+        local = declarations[-1]
+        if not local.defined:
+            # A variable is only undefined in its own initializer, where
+            # the name still refers to any outer declaration
+            if len(declarations) == 1:
+                return None
+            local = declarations[-2]
+        if local.function is self.function:
+            expr.slot = local.slot
+            local.references.append(expr)
+        else:
+            expr.slot = self.function.resolve_upvalue(local)
+            expr.cell = True
+        return local
 
     def visit_block(self, stmt):
         self.begin_scope()
@@ -38,7 +136,7 @@ class Resolver:
     def visit_class(self, stmt):
         enclosing = self.current_class
         self.current_class = "class"
-        self.declare(stmt.name)
+        self.declare(stmt.name, stmt)
         self.define(stmt.name)
         if stmt.superclass is not None:
             if stmt.name.lexeme == stmt.superclass.name.lexeme:
@@ -46,38 +144,41 @@ class Resolver:
             self.current_class = "subclass"
             self.resolve(stmt.superclass)
             self.begin_scope()
-            self.scopes[-1]["super"] = True
+            self.add_local("super", None).defined = True
 
-        self.begin_scope()
-        self.scopes[-1]["this"] = True
         for method in stmt.methods:
             declaration = "method"
             if method.name.lexeme == "init":
                 declaration = "initializer"
             self.resolve_function(method, declaration)
-        self.end_scope()
         if stmt.superclass is not None:
-            self.end_scope()
+            # Only methods refer to super, so it is either captured or unused
+            scope = self.end_scope()
+            if scope["super"].captured:
+                stmt.super_slot = scope["super"].slot
         self.current_class = enclosing
 
     def visit_var(self, stmt):
-        self.declare(stmt.name)
+        self.declare(stmt.name, stmt)
         if stmt.initializer is not None:
             self.resolve(stmt.initializer)
         self.define(stmt.name)
 
     def visit_variable(self, expr):
-        if self.scopes and not self.scopes[-1].get(expr.name.lexeme, True):
+        declarations = self.symbols.get(expr.name.lexeme)
+        if declarations and not declarations[-1].defined:
             self.lox.error(expr.name.line, "can't read variable in its own initializer")
 
-        self.resolve_local(expr, expr.name)
+        self.resolve_local(expr, expr.name.lexeme)
 
     def visit_assign(self, expr):
         self.resolve(expr.value)
-        self.resolve_local(expr, expr.name)
+        local = self.resolve_local(expr, expr.name.lexeme)
+        if local is not None and local.declaration.__class__ is Var:
+            local.declaration.assigned = True
 
     def visit_function(self, stmt):
-        self.declare(stmt.name)
+        self.declare(stmt.name, stmt)
         self.define(stmt.name)
         self.resolve_function(stmt, "function")
 
@@ -86,15 +187,80 @@ class Resolver:
             self.resolve(statement)
 
     def resolve_function(self, function, functype):
-        enclosing = self.current_function
-        self.current_function = functype
+        self.begin_function(function, functype)
+        if function.__class__ is LazyFunction:
+            self.defer(function)
+        else:
+            self.resolve_statements(function.body)
+        self.end_function(function)
+
+    # Called instead of resolving a LazyFunction's body, between begin_function
+    # and end_function, to save what resolving it later needs. Closures take
+    # their cells when they are made, which may be before the body is parsed,
+    # so every variable of an enclosing function that is named anywhere in
+    # the body is captured now, even if the body turns out to shadow it.
+    def defer(self, function):
+        lazy = Function.body.__get__(function)
+        state = self.function
+        symbols = self.symbols
+        outer = {}
+        after_dot = False
+        for token in lazy.tokens:
+            if token.type in REFERENCES and not after_dot:
+                names = [token.lexeme]
+                # super also reads this, the receiver its method is bound to
+                if token.type is Tt.SUPER:
+                    names.append("this")
+                for name in names:
+                    if name in outer:
+                        continue
+                    declarations = symbols.get(name)
+                    # Nothing declared in scope at a function declaration can
+                    # still be undefined, since initializers can't declare
+                    # functions
+                    if declarations and declarations[-1].function is not state:
+                        local = outer[name] = declarations[-1]
+                        state.resolve_upvalue(local)
+            after_dot = token.type == Tt.DOT
+        lazy.scope = (state.enclosing, state.kind, self.current_class, outer)
+
+    # Resolves the body of a LazyFunction that has just been parsed, in the
+    # scope defer saved
+    def resolve_body(self, function, body, lazy):
+        enclosing, kind, self.current_class, outer = lazy.scope
+        self.function = enclosing
+        self.symbols = {name: [local] for name, local in outer.items()}
+        self.begin_function(function, kind)
+        # The upvalues are the ones defer found, which closures of the
+        # function have been capturing since
+        self.function.captures = list(function.captures)
+        self.resolve_statements(body)
+        self.end_function(function)
+
+    # Resolves a function's parameters, after which its body can be resolved
+    def begin_function(self, function, functype):
+        self.function = FunctionState(self.function, functype)
         self.begin_scope()
+        if functype != "function":
+            # Methods receive this as their first argument
+            self.add_local("this", None).defined = True
         for param in function.params:
             self.declare(param)
             self.define(param)
-        self.resolve_statements(function.body)
-        self.end_scope()
-        self.current_function = enclosing
+
+    def end_function(self, function):
+        scope = self.end_scope()
+        # Captured arguments are moved into cells when the function is called
+        function.cells = tuple(
+            local.slot
+            for local in scope.values()
+            if local.captured and local.declaration is None
+        )
+        # Slots after the arguments, which include this for methods
+        arguments = len(function.params) + (self.function.kind != "function")
+        function.locals = self.function.frame_size - arguments
+        function.captures = tuple(self.function.captures)
+        self.function = self.function.enclosing
 
     def visit_expression(self, stmt):
         self.resolve(stmt.expr)
@@ -109,11 +275,11 @@ class Resolver:
         self.resolve(stmt.expr)
 
     def visit_return(self, stmt):
-        if not self.current_function:
-            self.lox.error(stmt.keyword, "can't return from top-level code")
+        if self.function.kind is None:
+            self.lox.error(stmt.keyword.line, "can't return from top-level code")
         if stmt.value is not None:
-            if self.current_function == "initializer":
-                self.lox.error(stmt.keyword, "can't return from initializer")
+            if self.function.kind == "initializer":
+                self.lox.error(stmt.keyword.line, "can't return from initializer")
             self.resolve(stmt.value)
 
     def visit_while(self, stmt):
@@ -148,12 +314,15 @@ class Resolver:
                 expr.keyword.line, "can't use super in class without superclass"
             )
 
-        self.resolve_local(expr, expr.keyword)
+        self.resolve_local(expr, expr.keyword.lexeme)
+        # The method's receiver, which super methods are bound to
+        expr.this = This(expr.keyword)
+        self.resolve_local(expr.this, "this")
 
     def visit_this(self, expr):
         if not self.current_class:
             return self.lox.error(expr.keyword.line, "Can't use 'this' outside class")
-        self.resolve_local(expr, expr.keyword)
+        self.resolve_local(expr, expr.keyword.lexeme)
 
     def visit_grouping(self, expr):
         self.resolve(expr.expression)
@@ -161,8 +330,8 @@ class Resolver:
     def visit_literal(self, expr):
         pass
 
-        def visit_unary(self, expr):
-            self.resolve(expr.right)
+    def visit_unary(self, expr):
+        self.resolve(expr.right)
 
     def resolve(self, host):
-        host.accept(self)
+        self.handlers[host.__class__](host)
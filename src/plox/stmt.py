@@ -1,29 +1,61 @@
+from .nodes import make_node
+
+
 class Stmt:
-    pass
+    __slots__ = ()
 
 
 # This is just a convenience method which allows us to elide full class definitions
 # The first argument is the class name, and the remaining arguments are the parameters that the class takes
 # The function generates a class accepting those parameters, as well as an accept method for the visitor pattern
-def _makeclass(*args1):
-    def init(self, *args2):
-        super(Stmt, self).__init__()
-        for key, value in zip(args1[1:], args2):
-            setattr(self, key, value)
-
-    def accept(self, visitor):
-        funcname = f"visit_{args1[0].lower()}"
-        return getattr(visitor, funcname)(self)
-
-    return type(args1[0], (Stmt,), {"__init__": init, "accept": accept})
+# Every node also gets calls, which the trampoline sets on nodes that contain a
+# call, see trampoline.TrampolineInterpreter.find_calls
+def _makeclass(*args, **defaults):
+    return make_node(Stmt, *args, calls=False, **defaults)
 
 
+# The resolver fills in slot and cell on local declarations, like on the
+# expressions that refer to them, see expr.py. For functions it also fills in
+# locals, the number of frame slots the function needs after its arguments;
+# cells, the slots of arguments that are captured; and captures, the slots of
+# the enclosing frame holding the cells the function closes over. super_slot is
+# the slot of the cell holding the superclass, if a method uses super.
 Block = _makeclass("Block", "statements")
-Class = _makeclass("Class", "name", "superclass", "methods")
+Class = _makeclass(
+    "Class", "name", "superclass", "methods", slot=None, cell=False, super_slot=None
+)
 Expression = _makeclass("Expression", "expr")
-Function = _makeclass("Function", "name", "params", "body")
+Function = _makeclass(
+    "Function",
+    "name",
+    "params",
+    "body",
+    slot=None,
+    cell=False,
+    locals=0,
+    cells=(),
+    captures=(),
+)
 If = _makeclass("If", "condition", "thenbranch", "elsebranch")
 Print = _makeclass("Print", "expr")
 Return = _makeclass("Return", "keyword", "value")
-Var = _makeclass("Var", "name", "initializer")
+# The resolver sets assigned on local variables that are assigned after their
+# declaration
+Var = _makeclass("Var", "name", "initializer", slot=None, cell=False, assigned=False)
 While = _makeclass("While", "condition", "body")
+
+
+# In lazy mode, the parser only skips over a function's body, and its body
+# slot holds a parser.LazyBody instead. The body is parsed, resolved and
+# optimized the first time it is read, which turns the node into a Function.
+# Walks over the AST don't go into the body until then, since it isn't among
+# the fields.
+class LazyFunction(Function):
+    __slots__ = ()
+    fields = ("name", "params")
+
+    def parse(self):
+        lazy = Function.body.__get__(self)
+        return lazy.lox.parse_body(self, lazy)
+
+    body = property(parse, Function.body.__set__)
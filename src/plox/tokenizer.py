@@ -1,12 +1,59 @@
-from enum import Enum
+import re
+from array import array
+from sys import intern
+
+
+# Token types are plain ints, which are cheaper to compare and hash than Enum
+# members
+class Tt:
+    LEFT_PAREN = 1
+    RIGHT_PAREN = 2
+    LEFT_BRACE = 3
+    RIGHT_BRACE = 4
+    COMMA = 5
+    DOT = 6
+    MINUS = 7
+    PLUS = 8
+    SEMI = 9
+    SLASH = 10
+    STAR = 11
+    BANG = 12
+    BANG_EQUAL = 13
+    EQUAL = 14
+    EQUAL_EQUAL = 15
+    GREATER = 16
+    GREATER_EQUAL = 17
+    LESS = 18
+    LESS_EQUAL = 19
+    IDENTIFIER = 20
+    STRING = 21
+    NUMBER = 22
+    AND = 23
+    CLASS = 24
+    ELSE = 25
+    FALSE = 26
+    FUN = 27
+    FOR = 28
+    IF = 29
+    NIL = 30
+    OR = 31
+    PRINT = 32
+    RETURN = 33
+    SUPER = 34
+    THIS = 35
+    TRUE = 36
+    VAR = 37
+    WHILE = 38
+    EOF = 39
 
-Tt = Enum(
-    "Tt",
-    "LEFT_PAREN RIGHT_PAREN LEFT_BRACE RIGHT_BRACE COMMA DOT MINUS PLUS SEMI SLASH STAR BANG BANG_EQUAL EQUAL EQUAL_EQUAL GREATER GREATER_EQUAL LESS LESS_EQUAL IDENTIFIER STRING NUMBER AND CLASS ELSE FALSE FUN FOR IF NIL OR PRINT RETURN SUPER THIS TRUE VAR WHILE EOF",
-)
+
+# Names of the token types, for printing tokens
+TYPE_NAMES = {value: name for name, value in vars(Tt).items() if name.isupper()}
 
 
 class Token:
+    __slots__ = ("type", "lexeme", "literal", "line")
+
     def __init__(self, type, lexeme, literal, line):
         self.type, self.lexeme, self.literal, self.line = (
             type,
@@ -16,7 +63,116 @@ class Token:
         )
 
     def __repr__(self):
-        return f"{self.type} {self.lexeme} {self.literal}"
+        return f"Tt.{TYPE_NAMES[self.type]} {self.lexeme} {self.literal}"
+
+    def __getstate__(self):
+        return (self.type, self.lexeme, self.literal, self.line)
+
+    def __setstate__(self, state):
+        self.type, self.lexeme, self.literal, self.line = state
+
+
+SINGLES = {
+    "(": Tt.LEFT_PAREN,
+    ")": Tt.RIGHT_PAREN,
+    "{": Tt.LEFT_BRACE,
+    "}": Tt.RIGHT_BRACE,
+    ",": Tt.COMMA,
+    ".": Tt.DOT,
+    "+": Tt.PLUS,
+    "-": Tt.MINUS,
+    ";": Tt.SEMI,
+    "*": Tt.STAR,
+}
+
+DOUBLES = {
+    "!": ("=", Tt.BANG_EQUAL, Tt.BANG),
+    "=": ("=", Tt.EQUAL_EQUAL, Tt.EQUAL),
+    "<": ("=", Tt.LESS_EQUAL, Tt.LESS),
+    ">": ("=", Tt.GREATER_EQUAL, Tt.GREATER),
+}
+
+KEYWORDS = {
+    "and": Tt.AND,
+    "class": Tt.CLASS,
+    "else": Tt.ELSE,
+    "false": Tt.FALSE,
+    "for": Tt.FOR,
+    "fun": Tt.FUN,
+    "if": Tt.IF,
+    "nil": Tt.NIL,
+    "or": Tt.OR,
+    "print": Tt.PRINT,
+    "return": Tt.RETURN,
+    "super": Tt.SUPER,
+    "this": Tt.THIS,
+    "true": Tt.TRUE,
+    "var": Tt.VAR,
+    "while": Tt.WHILE,
+}
+
+# Identifiers and keywords have their lexeme as their literal
+NAMES = {Tt.IDENTIFIER, *KEYWORDS.values()}
+
+# Every operator's lexeme, and its type
+OPERATORS = dict(SINGLES, **{"/": Tt.SLASH})
+for char, (second, double, single) in DOUBLES.items():
+    OPERATORS[char] = single
+    OPERATORS[char + second] = double
+
+# Skips spaces and tabs, then matches one lexeme, with one alternative per kind
+# of lexeme, tried in order. Identifiers and numbers follow str.isalpha, isalnum
+# and isdigit like Tokenizer does, and anything left over is a single invalid
+# character.
+LEXEME = re.compile(
+    r"""
+    [ \t\r]*
+    (?:
+        (?P<name>[^\W\d]\w*)
+        | (?P<comment>//[^\n]*)
+        | (?P<operator>[!=<>]=?|[(){},.+\-;*/])
+        | (?P<newline>\n)
+        | (?P<number>\d+(?:\.\d+)?)
+        | (?P<string>"[^"]*")
+        | (?P<unterminated>")
+        | (?P<invalid>[^ \t\r])
+    )
+    """,
+    re.VERBOSE,
+)
+
+
+# LEXEME for UTF-8 encoded bytes, with %s standing for an extra first
+# alternative. Telling letters from other characters outside ASCII needs the
+# decoded text, so chunks with bytes outside ASCII use UTF8_LEXEME, which
+# matches each run of word characters and dots containing such bytes whole, to
+# be decoded and split with LEXEME. No token that LEXEME would match crosses
+# the edge of such a run, so the tokens come out the same.
+BYTE_LEXEME = rb"""
+    [ \t\r]*
+    (?:
+        %s
+        (?P<name>[A-Za-z_]\w*)
+        | (?P<comment>//[^\n]*)
+        | (?P<operator>[!=<>]=?|[(){},.+\-;*/])
+        | (?P<newline>\n)
+        | (?P<number>\d+(?:\.\d+)?)
+        | (?P<string>"[^"]*")
+        | (?P<unterminated>")
+        | (?P<invalid>[^ \t\r])
+    )
+    """
+ASCII_LEXEME = re.compile(BYTE_LEXEME % b"", re.VERBOSE)
+UTF8_LEXEME = re.compile(
+    BYTE_LEXEME % rb"(?P<utf8>[\w.]*[\x80-\xff][\w.\x80-\xff]*) |", re.VERBOSE
+)
+# Bytes MmapTokenizer reads at a time, rounded up to the end of a line
+CHUNK = 1 << 20
+
+# OPERATORS by their encoded lexeme, with the lexeme
+BYTE_OPERATORS = {
+    lexeme.encode(): (type, lexeme) for lexeme, type in OPERATORS.items()
+}
 
 
 class Tokenizer:
@@ -28,44 +184,9 @@ class Tokenizer:
         self.source = source
         self.source_len = len(self.source)
 
-        self.singles = {
-            "(": Tt.LEFT_PAREN,
-            ")": Tt.RIGHT_PAREN,
-            "{": Tt.LEFT_BRACE,
-            "}": Tt.RIGHT_BRACE,
-            ",": Tt.COMMA,
-            ".": Tt.DOT,
-            "+": Tt.PLUS,
-            "-": Tt.MINUS,
-            ";": Tt.SEMI,
-            "*": Tt.STAR,
-        }
-
-        self.doubles = {
-            "!": ("=", Tt.BANG_EQUAL, Tt.BANG),
-            "=": ("=", Tt.EQUAL_EQUAL, Tt.EQUAL),
-            "<": ("=", Tt.LESS_EQUAL, Tt.LESS),
-            ">": ("=", Tt.GREATER_EQUAL, Tt.GREATER),
-        }
-
-        self.keywords = {
-            "and": Tt.AND,
-            "class": Tt.CLASS,
-            "else": Tt.ELSE,
-            "false": Tt.FALSE,
-            "for": Tt.FOR,
-            "fun": Tt.FUN,
-            "if": Tt.IF,
-            "nil": Tt.NIL,
-            "or": Tt.OR,
-            "print": Tt.PRINT,
-            "return": Tt.RETURN,
-            "super": Tt.SUPER,
-            "this": Tt.THIS,
-            "true": Tt.TRUE,
-            "var": Tt.VAR,
-            "while": Tt.WHILE,
-        }
+        self.singles = SINGLES
+        self.doubles = DOUBLES
+        self.keywords = KEYWORDS
 
     def is_at_end(self):
         return self.current >= self.source_len
@@ -196,3 +317,215 @@ class Tokenizer:
         self.tokens.append(Token(Tt.EOF, "", None, self.line))
 
         return self.tokens
+
+
+# Does the same as Tokenizer, matching a whole lexeme at a time with LEXEME
+# instead of looking at one character at a time
+class FastTokenizer:
+    def __init__(self, lox, source, line=1):
+        self.lox = lox
+        # A string, or an iterable of lines, like an open file
+        self.source = source
+        # The line source starts on
+        self.line = line
+
+    def tokenize(self):
+        return list(self.tokens())
+
+    # Yields the tokens one at a time, reading lines from the source only as
+    # they are needed. Only strings can span lines, so the rest of a line
+    # after an opening quote is carried over until the closing one turns up.
+    def tokens(self):
+        source = self.source
+        lines = [source] if type(source) is str else source
+        line = self.line
+        rest = ""
+        for text in lines:
+            if rest:
+                text = rest + text
+                rest = ""
+            for match in LEXEME.finditer(text):
+                kind = match.lastgroup
+                lexeme = match.group(kind)
+                if kind == "name":
+                    lexeme = intern(lexeme)
+                    yield Token(KEYWORDS.get(lexeme, Tt.IDENTIFIER), lexeme, lexeme, line)
+                elif kind == "operator":
+                    yield Token(OPERATORS[lexeme], lexeme, None, line)
+                elif kind == "newline":
+                    line += 1
+                elif kind == "number":
+                    yield Token(Tt.NUMBER, lexeme, float(lexeme), line)
+                elif kind == "string":
+                    # A string is on the line it ends on
+                    line += lexeme.count("\n")
+                    value = lexeme[1:-1]
+                    yield Token(Tt.STRING, value, value, line)
+                elif kind == "unterminated":
+                    rest = text[match.start(kind) :]
+                    break
+                elif kind == "invalid":
+                    self.lox.error(line, "Invalid lexeme.")
+        if rest:
+            line += rest.count("\n")
+            self.lox.error(line, "unterminated string")
+        yield Token(Tt.EOF, "", None, line)
+
+
+# Does the same as FastTokenizer, on UTF-8 encoded bytes, like a memory-mapped
+# file, decoding each lexeme only as its token is made. The source is read a
+# chunk of whole lines at a time, so a large file is only paged in as it is
+# tokenized.
+class MmapTokenizer:
+    def __init__(self, lox, source):
+        self.lox = lox
+        # Anything bytes-like; strings typed at the prompt are encoded
+        self.source = source.encode() if type(source) is str else source
+
+    def tokenize(self):
+        return list(self.tokens())
+
+    def tokens(self):
+        source = self.source
+        size = len(source)
+        # The type and decoded lexeme of each identifier and keyword seen so far
+        names = {}
+        line = 1
+        start = reach = 0
+        while start < size:
+            end = source.find(b"\n", max(min(start + CHUNK, size), reach))
+            end = size if end < 0 else end + 1
+            chunk = source[start:end]
+            lexemes = ASCII_LEXEME if chunk.isascii() else UTF8_LEXEME
+            for match in lexemes.finditer(chunk):
+                kind = match.lastgroup
+                raw = match.group(kind)
+                if kind == "name":
+                    name = names.get(raw)
+                    if name is None:
+                        lexeme = intern(raw.decode())
+                        name = names[raw] = (KEYWORDS.get(lexeme, Tt.IDENTIFIER), lexeme)
+                    yield Token(name[0], name[1], name[1], line)
+                elif kind == "operator":
+                    type, lexeme = BYTE_OPERATORS[raw]
+                    yield Token(type, lexeme, None, line)
+                elif kind == "newline":
+                    line += 1
+                elif kind == "number":
+                    lexeme = raw.decode()
+                    yield Token(Tt.NUMBER, lexeme, float(lexeme), line)
+                elif kind == "string":
+                    line += raw.count(b"\n")
+                    value = raw[1:-1].decode()
+                    yield Token(Tt.STRING, value, value, line)
+                elif kind == "utf8":
+                    # Only names, numbers, dots and invalid characters can be
+                    # in it
+                    for match in LEXEME.finditer(raw.decode()):
+                        kind = match.lastgroup
+                        lexeme = match.group(kind)
+                        if kind == "name":
+                            lexeme = intern(lexeme)
+                            type = KEYWORDS.get(lexeme, Tt.IDENTIFIER)
+                            yield Token(type, lexeme, lexeme, line)
+                        elif kind == "number":
+                            yield Token(Tt.NUMBER, lexeme, float(lexeme), line)
+                        elif kind == "operator":
+                            yield Token(OPERATORS[lexeme], lexeme, None, line)
+                        else:
+                            self.lox.error(line, "Invalid lexeme.")
+                elif kind == "unterminated":
+                    # The string may end in a later chunk, so go back to its
+                    # quote with a chunk that reaches the closing one
+                    quote = start + match.start(kind)
+                    reach = source.find(b'"', quote + 1)
+                    if reach < 0:
+                        line += source[quote:].count(b"\n")
+                        self.lox.error(line, "unterminated string")
+                        end = size
+                    else:
+                        end = quote
+                    break
+                elif kind == "invalid":
+                    self.lox.error(line, "Invalid lexeme.")
+            start = end
+        yield Token(Tt.EOF, "", None, line)
+
+
+# Tokens stored a column at a time: their types, where they start and end in
+# the source, and their lines, in arrays, which take 13 bytes per token.
+# Tokens are made as they are read, slicing the lexeme out of the source.
+class TokenBuffer:
+    def __init__(self, source):
+        self.source = source
+        self.types = array("B")
+        self.starts = array("I")
+        self.ends = array("I")
+        self.lines = array("I")
+
+    def __len__(self):
+        return len(self.types)
+
+    def __iter__(self):
+        for index in range(len(self.types)):
+            yield self[index]
+
+    def __getitem__(self, index):
+        type = self.types[index]
+        start, end = self.starts[index], self.ends[index]
+        if type == Tt.STRING:
+            lexeme = literal = self.source[start + 1 : end - 1]
+        elif type in NAMES:
+            lexeme = literal = intern(self.source[start:end])
+        else:
+            lexeme = self.source[start:end]
+            literal = float(lexeme) if type == Tt.NUMBER else None
+        return Token(type, lexeme, literal, self.lines[index])
+
+
+# Does the same as FastTokenizer, but puts the tokens in a TokenBuffer
+class BufferTokenizer:
+    def __init__(self, lox, source):
+        self.lox = lox
+        self.source = source
+
+    def tokenize(self):
+        source = self.source
+        tokens = TokenBuffer(source)
+        add_type = tokens.types.append
+        add_start = tokens.starts.append
+        add_end = tokens.ends.append
+        add_line = tokens.lines.append
+        line = 1
+        for match in LEXEME.finditer(source):
+            kind = match.lastgroup
+            if kind == "newline":
+                line += 1
+                continue
+            if kind == "name":
+                type = KEYWORDS.get(match.group(kind), Tt.IDENTIFIER)
+            elif kind == "operator":
+                type = OPERATORS[match.group(kind)]
+            elif kind == "number":
+                type = Tt.NUMBER
+            elif kind == "string":
+                line += match.group(kind).count("\n")
+                type = Tt.STRING
+            elif kind == "unterminated":
+                line += source.count("\n", match.end())
+                self.lox.error(line, "unterminated string")
+                break
+            else:
+                if kind == "invalid":
+                    self.lox.error(line, "Invalid lexeme.")
+                continue
+            start, end = match.span(kind)
+            add_type(type)
+            add_start(start)
+            add_end(end)
+            add_line(line)
+        add_type(Tt.EOF)
+        add_start(len(source))
+        add_end(len(source))
+        add_line(line)
+        return tokens
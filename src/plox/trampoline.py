@@ -0,0 +1,267 @@
+from .classes import BoundMethod, LoxClass, LoxInstance, get_entry, set_entry
+from .env import Cell
+from .errors import RuntimeError
+from .expr import Call, Get
+from .fun import Fun, LazyFun
+from .interpreter import Interpreter
+from .nodes import Handlers
+from .stmt import Class, Function, LazyFunction
+from .tokenizer import Tt
+
+
+# Like Handlers, but caches the step_ generator method for each node class
+class Steps(Handlers):
+    def __missing__(self, cls):
+        step = self[cls] = getattr(self.visitor, "step" + cls.handler[5:])
+        return step
+
+
+# A tree-walker that doesn't use the Python stack for Lox calls, so recursion
+# is only limited by lox.max_depth. Nodes that may call a Lox function run as
+# generators, which yield (callee, args, paren, tail) to ask for a call and
+# are sent its result. drive keeps the generators of the running calls on an
+# explicit stack. Everything else runs on the tree-walker's own visitors.
+class TrampolineInterpreter(Interpreter):
+    def __init__(self, lox):
+        super().__init__(lox)
+        self.max_depth = lox.max_depth
+        self.steps = Steps(self)
+
+    # Sets calls on the nodes that contain a call, outside any function
+    # declared in them
+    def find_calls(self, node):
+        if type(node) is list:
+            found = False
+            for item in node:
+                found = self.find_calls(item) or found
+            return found
+        fields = getattr(node.__class__, "fields", None)
+        if fields is None:
+            return False
+        found = node.__class__ is Call
+        for field in fields:
+            found = self.find_calls(getattr(node, field)) or found
+        # Declaring a function doesn't run its body
+        if node.__class__ is Function or node.__class__ is Class:
+            return False
+        if found:
+            node.calls = True
+        return found
+
+    def interpret(self, statements):
+        self.find_calls(statements)
+        try:
+            for statement in statements:
+                if statement.calls:
+                    self.drive(self.steps[statement.__class__](statement))
+                else:
+                    self.eval(statement)
+        except RuntimeError as e:
+            self.lox.runtime_error(e)
+
+    # Runs the generator of a top-level statement to the end
+    def drive(self, step):
+        # Each entry is a generator, the frame it runs in, and for
+        # initializers the instance the call returns
+        top = self.frame
+        stack = [(step, top, None)]
+        try:
+            self.run_stack(stack)
+        finally:
+            self.frame = top
+
+    def run_stack(self, stack):
+        value = None
+        while True:
+            step, self.frame, this = stack[-1]
+            try:
+                request = step.send(value)
+            except StopIteration as stop:
+                stack.pop()
+                if not stack:
+                    return
+                if this is not None:
+                    value = this
+                elif stop.value is not None:
+                    value = stop.value[0]
+                else:
+                    value = None
+                continue
+            callee, args, paren, tail = request
+            if tail:
+                # The caller would only return the result, so the callee
+                # replaces it and returns to the caller's caller instead
+                stack.pop()
+            this = None
+            if type(callee) is BoundMethod:
+                args.insert(0, callee.receiver)
+                callee = callee.method
+            elif type(callee) is LoxClass:
+                this = LoxInstance(callee)
+                init = callee.methods.get("init")
+                if init is None:
+                    value = this
+                    continue
+                args.insert(0, this)
+                callee = init
+            if type(callee) is not Fun:
+                if type(callee) is not LazyFun:
+                    value = callee.call(self, args)
+                    continue
+                # A body parsed only now hasn't been searched for calls
+                if callee.declaration.__class__ is LazyFunction:
+                    self.find_calls(callee.declaration.parse())
+                callee.force()
+            # The top-level statement doesn't count towards the depth
+            if len(stack) > self.max_depth:
+                raise RuntimeError(paren, "Stack overflow")
+            if callee.is_initializer:
+                this = args[0]
+            frame = args
+            frame += callee.rest
+            for slot in callee.declaration.cells:
+                frame[slot] = Cell(frame[slot])
+            stack.append((self.run_block(callee.declaration.body), frame, this))
+            value = None
+
+    # Runs a statement or evaluates an expression, as a generator
+    def step(self, node):
+        if node.calls:
+            return (yield from self.steps[node.__class__](node))
+        return self.handlers[node.__class__](node)
+
+    def run_block(self, statements):
+        for statement in statements:
+            result = yield from self.step(statement)
+            if result is not None:
+                return result
+
+    # Evaluates the callee and arguments of a call, and checks them. Methods
+    # get the receiver as the first argument, like in Interpreter.invoke.
+    def prepare_call(self, expr):
+        get = expr.callee
+        if get.__class__ is Get:
+            ob = yield from self.step(get.object)
+            if type(ob) is not LoxInstance:
+                raise RuntimeError(get.name, "only instances have properties")
+            if ob.shape is get.shape:
+                entry = get.entry
+            else:
+                entry = get_entry(get, ob, get.name)
+            if type(entry) is not int:
+                args = [ob]
+                for arg in expr.arguments:
+                    args.append((yield from self.step(arg)))
+                if len(args) - 1 != entry.arity():
+                    raise RuntimeError(
+                        expr.paren,
+                        f"wrong argument count: expected {entry.arity()}, got {len(args) - 1}",
+                    )
+                return entry, args
+            callee = ob.values[entry]
+        else:
+            callee = yield from self.step(get)
+        args = []
+        for arg in expr.arguments:
+            args.append((yield from self.step(arg)))
+        if not hasattr(callee, "call"):
+            raise RuntimeError(expr.paren, "can only call functions or classes")
+        if len(args) != callee.arity():
+            raise RuntimeError(
+                expr.paren,
+                f"wrong argument count: expected {callee.arity()}, got {len(args)}",
+            )
+        return callee, args
+
+    def step_call(self, expr):
+        callee, args = yield from self.prepare_call(expr)
+        return (yield (callee, args, expr.paren, False))
+
+    def step_return(self, stmt):
+        value = stmt.value
+        if value.__class__ is Call:
+            callee, args = yield from self.prepare_call(value)
+            return ((yield (callee, args, value.paren, True)),)
+        return ((yield from self.step(value)),)
+
+    def step_assign(self, expr):
+        value = yield from self.step(expr.value)
+        if expr.slot is None:
+            self.g.assign(expr.name, value)
+        elif expr.cell:
+            self.frame[expr.slot].value = value
+        else:
+            self.frame[expr.slot] = value
+        return value
+
+    def step_binary(self, expr):
+        left = yield from self.step(expr.left)
+        right = yield from self.step(expr.right)
+        return self.binary(expr.operator, left, right)
+
+    def step_get(self, expr):
+        ob = yield from self.step(expr.object)
+        if type(ob) is not LoxInstance:
+            raise RuntimeError(expr.name, "only instances have properties")
+        if ob.shape is expr.shape:
+            entry = expr.entry
+        else:
+            entry = get_entry(expr, ob, expr.name)
+        if type(entry) is int:
+            return ob.values[entry]
+        return entry.bind(ob)
+
+    def step_grouping(self, expr):
+        return (yield from self.step(expr.expression))
+
+    def step_logical(self, expr):
+        left = yield from self.step(expr.left)
+        if (expr.operator.type == Tt.OR) == self.is_truthy(left):
+            return left
+        return (yield from self.step(expr.right))
+
+    def step_set(self, expr):
+        ob = yield from self.step(expr.object)
+        if type(ob) is not LoxInstance:
+            raise RuntimeError(expr.name, "can only set properties on instances")
+        value = yield from self.step(expr.value)
+        if ob.shape is expr.shape:
+            slot, shape = expr.entry
+        else:
+            slot, shape = set_entry(expr, ob, expr.name)
+        if shape is None:
+            ob.values[slot] = value
+        else:
+            ob.values.append(value)
+            ob.shape = shape
+        return value
+
+    def step_unary(self, expr):
+        right = yield from self.step(expr.right)
+        return self.unary(expr.operator, right)
+
+    def step_block(self, stmt):
+        return (yield from self.run_block(stmt.statements))
+
+    def step_expression(self, stmt):
+        yield from self.step(stmt.expr)
+
+    def step_if(self, stmt):
+        if self.is_truthy((yield from self.step(stmt.condition))):
+            return (yield from self.step(stmt.thenbranch))
+        elif stmt.elsebranch is not None:
+            return (yield from self.step(stmt.elsebranch))
+
+    def step_print(self, stmt):
+        value = yield from self.step(stmt.expr)
+        print(self.stringify(value))
+
+    def step_var(self, stmt):
+        value = yield from self.step(stmt.initializer)
+        self.define(stmt, value)
+
+    def step_while(self, stmt):
+        while self.is_truthy((yield from self.step(stmt.condition))):
+            result = yield from self.step(stmt.body)
+            if result is not None:
+                return result
@@ -0,0 +1,717 @@
+import keyword
+
+from . import pyruntime
+from .errors import RuntimeError
+from .expr import Assign, Call, Grouping, Literal, Set, This, Variable
+from .nodes import walk
+from .stmt import Block, If
+from .tokenizer import Token, Tt
+
+ARITHMETIC = {
+    Tt.PLUS: ("+", "_add"),
+    Tt.MINUS: ("-", "_numbers"),
+    Tt.STAR: ("*", "_numbers"),
+    Tt.SLASH: ("/", "_div"),
+    Tt.GREATER: (">", "_numbers"),
+    Tt.GREATER_EQUAL: (">=", "_numbers"),
+    Tt.LESS: ("<", "_numbers"),
+    Tt.LESS_EQUAL: ("<=", "_numbers"),
+}
+
+# Marks, as "\0line\0", where generated code for the token on a Lox line
+# begins. Lox strings are emitted as reprs, which escape a NUL, so it can't
+# appear otherwise.
+MARK = "\0"
+
+# Operators whose result is always a bool, so no truthiness test is needed
+PREDICATES = {
+    Tt.BANG,
+    Tt.BANG_EQUAL,
+    Tt.EQUAL_EQUAL,
+    Tt.GREATER,
+    Tt.GREATER_EQUAL,
+    Tt.LESS,
+    Tt.LESS_EQUAL,
+}
+
+
+def mangle(name):
+    # Lox identifiers that are Python keywords, or that could collide with the
+    # underscore-prefixed helpers and temporaries, get a trailing underscore
+    if keyword.iskeyword(name) or name.startswith("_") or name.endswith("_"):
+        return name + "_"
+    return name
+
+
+def first_line(expr):
+    # Line of the first token of an expression, or None for a literal, which
+    # can't raise anything to report a line for
+    lines = [
+        value.line
+        for node in walk(expr)
+        for value in (getattr(node, field) for field in node.fields)
+        if type(value) is Token
+    ]
+    return min(lines, default=None)
+
+
+def has_effects(expr):
+    # Whether evaluating expr may assign a variable
+    if isinstance(expr, (Assign, Set, Call)):
+        return True
+    return any(
+        has_effects(child)
+        for child in (getattr(expr, field) for field in expr.fields)
+        if hasattr(child, "accept")
+    )
+
+
+class Declaration:
+    def __init__(self, name, owner, in_loop):
+        self.name = name
+        self.owner = owner
+        self.in_loop = in_loop
+        self.captured = False
+        self.py = None
+
+    @property
+    def boxed(self):
+        # A captured variable declared in a loop body needs a fresh binding per
+        # iteration, but Python closures capture the variable, not the binding
+        return self.captured and self.in_loop
+
+
+class FunctionInfo:
+    def __init__(self, parent):
+        self.parent = parent
+        self.names = set()
+        self.loop_depth = 0
+        # The declaration in each slot of the function's frame, as the
+        # resolver numbered them, and the declaration of each upvalue
+        self.frame = {}
+        self.upvalues = []
+        self.captures = []
+        self.assigns = []
+
+    def binds(self):
+        return [decl for decl in self.captures if decl.boxed]
+
+
+# Finds out which variables are Lox globals, which are locals and which
+# function owns them, and which locals are captured by inner functions. The
+# resolver has already worked all of that out as slots, so this only maps
+# the slots of each function's frame, and its upvalues, onto declarations.
+class Analyzer:
+    def __init__(self):
+        self.module = self.function = FunctionInfo(None)
+        self.declarations = []
+        self.decls = {}
+        self.refs = {}
+        self.functions = {}
+        self.globals = set()
+        self.methods = set()
+
+    def analyze(self, statements):
+        for statement in statements:
+            statement.accept(self)
+
+    # Declares a local in slot, or a global if slot is None
+    def declare(self, key, name, slot):
+        if slot is None:
+            self.globals.add(mangle(name))
+            return
+        self.function.frame[slot] = self.local(key, name)
+
+    def local(self, key, name):
+        decl = Declaration(name, self.function, self.function.loop_depth > 0)
+        self.declarations.append(decl)
+        self.decls[key] = decl
+        return decl
+
+    def reference(self, node, name, assign=False):
+        function = self.function
+        if node.slot is None:
+            self.globals.add(mangle(name))
+            self.refs[node] = None
+        elif node.slot >= 0:
+            self.refs[node] = function.frame[node.slot]
+        else:
+            decl = self.refs[node] = function.upvalues[-1 - node.slot]
+            if assign and decl not in function.assigns:
+                function.assigns.append(decl)
+
+    def function_body(self, stmt, this=None):
+        enclosing = self.function
+        function = self.function = self.functions[stmt] = FunctionInfo(enclosing)
+        # Captures are slots of the enclosing frame, or of its upvalues if
+        # negative, like the slots of references
+        for slot in stmt.captures:
+            if slot >= 0:
+                decl = enclosing.frame[slot]
+                decl.captured = True
+                # Boxes are bound when the outermost nested function is created
+                function.captures.append(decl)
+            else:
+                decl = enclosing.upvalues[-1 - slot]
+            function.upvalues.append(decl)
+        # Methods get this in the first slot, before the parameters
+        if this is not None:
+            self.declare(("this", stmt), "this", 0)
+        first = 0 if this is None else 1
+        for slot, param in enumerate(stmt.params, first):
+            self.declare(param, param.lexeme, slot)
+        for statement in stmt.body:
+            statement.accept(self)
+        self.function = enclosing
+
+    def visit_block(self, stmt):
+        for statement in stmt.statements:
+            statement.accept(self)
+
+    def visit_class(self, stmt):
+        self.declare(stmt, stmt.name.lexeme, stmt.slot)
+        if stmt.superclass is not None:
+            stmt.superclass.accept(self)
+            # Methods refer to super through the slot the resolver gave it,
+            # which it only records if they do
+            holder = self.local(("super", stmt), "super")
+            if stmt.super_slot is not None:
+                self.function.frame[stmt.super_slot] = holder
+        for method in stmt.methods:
+            self.methods.add(mangle(method.name.lexeme))
+            self.function_body(method, this=True)
+
+    def visit_expression(self, stmt):
+        stmt.expr.accept(self)
+
+    def visit_function(self, stmt):
+        self.declare(stmt, stmt.name.lexeme, stmt.slot)
+        self.function_body(stmt)
+
+    def visit_if(self, stmt):
+        stmt.condition.accept(self)
+        stmt.thenbranch.accept(self)
+        if stmt.elsebranch is not None:
+            stmt.elsebranch.accept(self)
+
+    def visit_print(self, stmt):
+        stmt.expr.accept(self)
+
+    def visit_return(self, stmt):
+        if stmt.value is not None:
+            stmt.value.accept(self)
+
+    def visit_var(self, stmt):
+        if stmt.initializer is not None:
+            stmt.initializer.accept(self)
+        self.declare(stmt, stmt.name.lexeme, stmt.slot)
+
+    def visit_while(self, stmt):
+        stmt.condition.accept(self)
+        self.function.loop_depth += 1
+        stmt.body.accept(self)
+        self.function.loop_depth -= 1
+
+    def visit_assign(self, expr):
+        expr.value.accept(self)
+        self.reference(expr, expr.name.lexeme, assign=True)
+
+    def visit_binary(self, expr):
+        expr.left.accept(self)
+        expr.right.accept(self)
+
+    def visit_call(self, expr):
+        expr.callee.accept(self)
+        for argument in expr.arguments:
+            argument.accept(self)
+
+    def visit_get(self, expr):
+        expr.object.accept(self)
+
+    def visit_grouping(self, expr):
+        expr.expression.accept(self)
+
+    def visit_literal(self, expr):
+        pass
+
+    def visit_logical(self, expr):
+        expr.left.accept(self)
+        expr.right.accept(self)
+
+    def visit_set(self, expr):
+        expr.value.accept(self)
+        expr.object.accept(self)
+
+    def visit_super(self, expr):
+        self.reference(expr, "super")
+        self.reference(expr.this, "this")
+
+    def visit_this(self, expr):
+        self.reference(expr, "this")
+
+    def visit_unary(self, expr):
+        expr.right.accept(self)
+
+    def visit_variable(self, expr):
+        self.reference(expr, expr.name.lexeme)
+
+
+# Turns a resolved Lox program into Python source, mapping Lox functions,
+# classes and locals onto their Python counterparts so that CPython's own
+# compiler and specialising interpreter do the heavy lifting. Dynamic checks
+# are inlined as guards with a fast path for the common case, falling back to
+# helpers from pyruntime that raise the Lox runtime errors.
+class Transpiler:
+    def __init__(self, filename="<lox>", reserved=()):
+        self.filename = filename
+        # Names that earlier code run in the same namespace already uses
+        self.reserved = set(reserved)
+
+    def transpile(self, statements):
+        analyzer = Analyzer()
+        analyzer.analyze(statements)
+        self.refs = analyzer.refs
+        self.decls = analyzer.decls
+        self.functions = analyzer.functions
+        self.module = analyzer.module
+        self.name_locals(analyzer)
+
+        self.source = []
+        self.line_map = [0]
+        self.line = 1
+        self.indent = 0
+        self.depth = 0
+        self.initializer = None
+        self.emit(f"# Generated by plox from {self.filename}")
+        self.emit("from plox.pyruntime import *")
+        self.emit("_g = globals()")
+        for statement in statements:
+            self.statement(statement)
+        return "\n".join(self.source) + "\n"
+
+    def name_locals(self, analyzer):
+        reserved = analyzer.globals | self.reserved | set(pyruntime.__all__) | {"_g"}
+        for decl in analyzer.declarations:
+            base = "this" if decl.name == "this" else mangle(decl.name)
+            taken = set(reserved)
+            function = decl.owner
+            while function is not None:
+                taken |= function.names
+                function = function.parent
+            if decl.boxed or decl.name == "super":
+                # These are passed to methods as defaults, which are evaluated
+                # in the class body where the method names are visible
+                taken |= analyzer.methods
+            name, n = base, 0
+            while name in taken:
+                n += 1
+                name = f"{base}_{n}"
+            decl.py = name
+            decl.owner.names.add(name)
+
+    def emit(self, text):
+        # Code for tokens on another line than the statement's goes on its own
+        # Python line, inside the brackets the mark follows, so an exception
+        # Python raises there maps to the token's line
+        parts = ("    " * self.indent + text).split(MARK)
+        line, code = self.line, parts[0]
+        for i in range(1, len(parts), 2):
+            if int(parts[i]) != line:
+                self.source.append(code)
+                self.line_map.append(line)
+                line, code = int(parts[i]), ""
+            code += parts[i + 1]
+        self.source.append(code)
+        self.line_map.append(line)
+
+    # Statements
+
+    def statement(self, stmt):
+        stmt.accept(self)
+
+    def body(self, statements):
+        self.indent += 1
+        start = len(self.source)
+        for statement in statements:
+            self.statement(statement)
+        if len(self.source) == start:
+            self.emit("pass")
+        self.indent -= 1
+
+    def block_statements(self, stmt):
+        # Blocks don't open Python scopes; shadowing was resolved by renaming
+        if isinstance(stmt, Block):
+            return stmt.statements
+        return [stmt]
+
+    def visit_block(self, stmt):
+        for statement in stmt.statements:
+            self.statement(statement)
+
+    def visit_expression(self, stmt):
+        expr = stmt.expr
+        self.line = first_line(expr) or self.line
+        if isinstance(expr, Assign):
+            decl = self.refs[expr]
+            if decl is not None and not decl.boxed:
+                self.emit(f"{decl.py} = {self.expr(expr.value)}")
+                return
+        elif isinstance(expr, Set) and isinstance(expr.object, This):
+            obj = self.expr(expr.object)
+            name = mangle(expr.name.lexeme)
+            self.emit(f"{obj}.{name} = {self.expr(expr.value)}")
+            return
+        self.emit(self.expr(expr))
+
+    def visit_print(self, stmt):
+        self.line = first_line(stmt.expr) or self.line
+        self.emit(f"_print(_stringify({self.expr(stmt.expr)}))")
+
+    def visit_var(self, stmt):
+        self.line = stmt.name.line
+        value = "None" if stmt.initializer is None else self.expr(stmt.initializer)
+        decl = self.decls.get(stmt)
+        if decl is None:
+            self.emit(f"{mangle(stmt.name.lexeme)} = {value}")
+        elif decl.boxed:
+            self.emit(f"{decl.py} = _Cell({value})")
+        else:
+            self.emit(f"{decl.py} = {value}")
+
+    def visit_if(self, stmt):
+        self.line = first_line(stmt.condition) or self.line
+        self.emit(f"if {self.condition(stmt.condition)}:")
+        self.body(self.block_statements(stmt.thenbranch))
+        branch = stmt.elsebranch
+        while branch is not None:
+            if isinstance(branch, If):
+                self.line = first_line(branch.condition) or self.line
+                self.emit(f"elif {self.condition(branch.condition)}:")
+                self.body(self.block_statements(branch.thenbranch))
+                branch = branch.elsebranch
+            else:
+                self.emit("else:")
+                self.body(self.block_statements(branch))
+                branch = None
+
+    def visit_while(self, stmt):
+        self.line = first_line(stmt.condition) or self.line
+        self.emit(f"while {self.condition(stmt.condition)}:")
+        self.body(self.block_statements(stmt.body))
+
+    def visit_return(self, stmt):
+        self.line = stmt.keyword.line
+        if self.initializer is not None:
+            self.emit(f"return {self.initializer}")
+        elif stmt.value is None:
+            self.emit("return None")
+        else:
+            self.emit(f"return {self.expr(stmt.value)}")
+
+    def visit_function(self, stmt):
+        decl = self.decls.get(stmt)
+        name = mangle(stmt.name.lexeme)
+        if decl is None:
+            self.function(stmt, name)
+        elif decl.boxed:
+            # Create the box first, so the function can bind it to call itself
+            self.line = stmt.name.line
+            self.emit(f"{decl.py} = _Cell(None)")
+            self.function(stmt, "_fn")
+            self.emit(f"_fn.__name__ = {name!r}")
+            self.emit(f"{decl.py}.v = _fn")
+        else:
+            self.function(stmt, decl.py)
+            if decl.py != name:
+                self.emit(f"{decl.py}.__name__ = {name!r}")
+
+    def function(self, stmt, py, initializer=False):
+        self.line = stmt.name.line
+        info = self.functions[stmt]
+        params = [self.decls[param].py for param in stmt.params]
+        this = self.decls.get(("this", stmt))
+        if this is not None:
+            params.insert(0, this.py)
+        binds = [f"{decl.py}={decl.py}" for decl in info.binds()]
+        if binds:
+            params += ["*"] + binds
+        self.emit(f"def {py}({', '.join(params)}):")
+        self.indent += 1
+        for decl in info.assigns:
+            if not decl.boxed:
+                scope = "global" if decl.owner is self.module else "nonlocal"
+                self.emit(f"{scope} {decl.py}")
+        enclosing = self.initializer
+        self.initializer = this.py if initializer else None
+        start = len(self.source)
+        for statement in stmt.body:
+            self.statement(statement)
+        if initializer:
+            self.emit(f"return {this.py}")
+        elif len(self.source) == start:
+            self.emit("pass")
+        self.initializer = enclosing
+        self.indent -= 1
+
+    def visit_class(self, stmt):
+        self.line = stmt.name.line
+        decl = self.decls.get(stmt)
+        py = mangle(stmt.name.lexeme) if decl is None else decl.py
+        if decl is not None and decl.boxed:
+            self.emit(f"{py} = _Cell(None)")
+        base = "_LoxObject"
+        if stmt.superclass is not None:
+            superclass = self.expr(stmt.superclass)
+            self.line = stmt.superclass.name.line
+            holder = self.decls[("super", stmt)]
+            base = holder.py
+            if holder.boxed:
+                self.emit(f"{base} = _Cell(_superclass({superclass}, {self.line}))")
+                base += ".v"
+            else:
+                self.emit(f"{base} = _superclass({superclass}, {self.line})")
+        self.line = stmt.name.line
+        boxed = decl is not None and decl.boxed
+        self.emit(f"class {'_cls' if boxed else py}({base}):")
+        self.indent += 1
+        self.emit(f"_name = {stmt.name.lexeme!r}")
+        for method in stmt.methods:
+            self.function(
+                method, mangle(method.name.lexeme), method.name.lexeme == "init"
+            )
+        self.indent -= 1
+        if boxed:
+            self.emit(f"{py}.v = _cls")
+
+    # Expressions
+
+    def expr(self, expr):
+        self.depth += 1
+        try:
+            return expr.accept(self)
+        finally:
+            self.depth -= 1
+
+    def simple(self, expr):
+        # Python source for expressions without side effects, which can be
+        # evaluated twice instead of being stored in a temporary
+        if isinstance(expr, Grouping):
+            return self.simple(expr.expression)
+        if isinstance(expr, (Literal, This)) or (
+            isinstance(expr, Variable) and not self.is_boxed(expr)
+        ):
+            return self.expr(expr)
+        return None
+
+    def is_boxed(self, expr):
+        decl = self.refs[expr]
+        return decl is not None and decl.boxed
+
+    def condition(self, expr):
+        # Python source for the truthiness of expr, as a bool
+        while isinstance(expr, Grouping):
+            expr = expr.expression
+        if isinstance(expr, Literal):
+            return repr(expr.value is not None and expr.value is not False)
+        if hasattr(expr, "operator") and expr.operator.type in PREDICATES:
+            return self.expr(expr)
+        if hasattr(expr, "operator") and expr.operator.type in (Tt.AND, Tt.OR):
+            op = "and" if expr.operator.type == Tt.AND else "or"
+            return f"({self.condition(expr.left)} {op} {self.condition(expr.right)})"
+        value = self.simple(expr)
+        if value is None:
+            value = f"_t{self.depth}"
+            return f"(({value} := {self.expr(expr)}) is not None and {value} is not False)"
+        return f"({value} is not None and {value} is not False)"
+
+    def visit_literal(self, expr):
+        if isinstance(expr.value, float):
+            # Folded constants can be infinite or nan, which have no literal
+            if expr.value - expr.value != 0.0:
+                return f"_float({str(expr.value)!r})"
+            return f"({expr.value!r})" if expr.value < 0 else repr(expr.value)
+        return repr(expr.value)
+
+    def visit_grouping(self, expr):
+        return self.expr(expr.expression)
+
+    def visit_variable(self, expr):
+        decl = self.refs[expr]
+        if decl is None:
+            # Raises a NameError if it's undefined
+            return f"({MARK}{expr.name.line}{MARK}{mangle(expr.name.lexeme)})"
+        if decl.boxed:
+            return f"{decl.py}.v"
+        return decl.py
+
+    def visit_this(self, expr):
+        return self.refs[expr].py
+
+    def visit_assign(self, expr):
+        value = self.expr(expr.value)
+        decl = self.refs[expr]
+        if decl is None:
+            name = mangle(expr.name.lexeme)
+            return f"_setg(_g, {name!r}, {value}, {expr.name.line})"
+        if decl.boxed:
+            return f"_setcell({decl.py}, {value})"
+        return f"({decl.py} := {value})"
+
+    def visit_unary(self, expr):
+        if expr.operator.type == Tt.BANG:
+            return f"(not {self.condition(expr.right)})"
+        line = expr.operator.line
+        right = expr.right
+        if isinstance(right, Literal) and isinstance(right.value, float):
+            return f"({-right.value!r})"
+        value = self.simple(right)
+        if value is None:
+            guard = f"_type(_a{self.depth} := {self.expr(right)}) is _float"
+            value = f"_a{self.depth}"
+        else:
+            guard = f"_type({value}) is _float"
+        return f"(-{value} if {guard} else _negate({value}, {line}))"
+
+    def visit_logical(self, expr):
+        if isinstance(expr.left, Literal):
+            value = expr.left.value
+            truthy = value is not None and value is not False
+            if truthy == (expr.operator.type == Tt.OR):
+                return self.expr(expr.left)
+            return self.expr(expr.right)
+        left = self.simple(expr.left)
+        value = left
+        if left is None:
+            left = f"_a{self.depth}"
+            value = f"({left} := {self.expr(expr.left)})"
+        truthy = f"{value} is not None and {left} is not False"
+        right = self.expr(expr.right)
+        if expr.operator.type == Tt.OR:
+            return f"({left} if {truthy} else {right})"
+        return f"({right} if {truthy} else {left})"
+
+    def operand(self, expr, temp, reuse):
+        # Returns the source used in the type guard (None for number literals,
+        # which need no check) and the source used to read the value again
+        while isinstance(expr, Grouping):
+            expr = expr.expression
+        if isinstance(expr, Literal) and isinstance(expr.value, float):
+            value = self.expr(expr)
+            return None, value
+        value = self.simple(expr) if reuse else None
+        if value is None:
+            return f"({temp} := {self.expr(expr)})", temp
+        return value, value
+
+    def visit_binary(self, expr):
+        op = expr.operator.type
+        if op == Tt.EQUAL_EQUAL or op == Tt.BANG_EQUAL:
+            left = self.expr(expr.left)
+            right = self.expr(expr.right)
+            return f"({left} {'==' if op == Tt.EQUAL_EQUAL else '!='} {right})"
+        pyop, slow = ARITHMETIC[op]
+        line = expr.operator.line
+        d = self.depth
+        right = expr.right
+        while isinstance(right, Grouping):
+            right = right.expression
+        if op == Tt.SLASH and isinstance(right, Literal) and right.value == 0.0:
+            return f"_div({self.expr(expr.left)}, {self.expr(right)}, {line})"
+        # The left operand may only be read twice if the right one can't
+        # change it in between
+        left_guard, left = self.operand(
+            expr.left, f"_a{d}", not has_effects(expr.right)
+        )
+        right_guard, right = self.operand(expr.right, f"_b{d}", True)
+        guards = [f"_type({guard})" for guard in (left_guard, right_guard) if guard]
+        if not guards:
+            return f"({left} {pyop} {right})"
+        guard = " is ".join(guards) + " is _float"
+        if op == Tt.SLASH and right_guard is not None:
+            guard += f" and {right}"
+        return f"({left} {pyop} {right} if {guard} else {slow}({left}, {right}, {line}))"
+
+    def visit_call(self, expr):
+        d = self.depth
+        callee = self.expr(expr.callee)
+        args = ", ".join(self.expr(argument) for argument in expr.arguments)
+        argc = len(expr.arguments)
+        c, k = f"_c{d}", f"_k{d}"
+        # Functions and bound methods with the right arity are called directly,
+        # anything else gets a callable from the slow path that instantiates a
+        # class or raises the Lox error
+        guard = (
+            f"({k} := _type({c} := {callee})) is _function and {c}.__code__.co_argcount == {argc}"
+            f" or {k} is _method and {c}.__code__.co_argcount == {argc + 1}"
+        )
+        return f"({c} if {guard} else _callable({c}, {argc}, {expr.paren.line}))({args})"
+
+    def visit_get(self, expr):
+        name = mangle(expr.name.lexeme)
+        # Either raises an AttributeError if there's no such property
+        mark = f"{MARK}{expr.name.line}{MARK}"
+        if isinstance(expr.object, This):
+            return f"({mark}{self.expr(expr.object)}.{name})"
+        obj = f"_o{self.depth}"
+        return (
+            f"({mark}{obj}.{name} if _isinstance({obj} := {self.expr(expr.object)}, _LoxObject)"
+            f" else _not_instance({expr.name.line}))"
+        )
+
+    def visit_set(self, expr):
+        name = mangle(expr.name.lexeme)
+        obj = self.expr(expr.object)
+        if not isinstance(expr.object, This):
+            obj = f"_instance({obj}, {expr.name.line})"
+        return f"_set({obj}, {name!r}, {self.expr(expr.value)})"
+
+    def visit_super(self, expr):
+        superclass = self.visit_variable(expr)
+        this = self.refs[expr.this].py
+        name = mangle(expr.method.lexeme)
+        return f"_super_get({superclass}, {this}, {name!r}, {expr.method.line})"
+
+
+class PythonEngine:
+    def __init__(self, lox):
+        self.lox = lox
+        self.namespace = {}
+        # Python line to Lox line, per generated module
+        self.line_maps = {}
+
+    def interpret(self, statements):
+        transpiler = Transpiler(f"<lox-{len(self.line_maps) + 1}>", self.namespace)
+        source = transpiler.transpile(statements)
+        self.line_maps[transpiler.filename] = transpiler.line_map
+        code = compile(source, transpiler.filename, "exec")
+        try:
+            exec(code, self.namespace)
+        except RuntimeError as e:
+            self.lox.runtime_error(e)
+        except (AttributeError, NameError, RecursionError) as e:
+            line = self.error_line(e.__traceback__)
+            if line is None:
+                raise
+            self.lox.runtime_error(self.lox_error(e, line))
+
+    def error_line(self, traceback):
+        # The Lox line of the innermost generated frame of a traceback
+        line = None
+        while traceback is not None:
+            line_map = self.line_maps.get(traceback.tb_frame.f_code.co_filename)
+            if line_map is not None:
+                line = line_map[traceback.tb_lineno]
+            traceback = traceback.tb_next
+        return line
+
+    def lox_error(self, error, line):
+        if isinstance(error, RecursionError):
+            return RuntimeError(None, "Stack overflow", line)
+        name = pyruntime.lox_name(error.name)
+        if isinstance(error, NameError):
+            return RuntimeError(
+                None, f"Attempt to access undefined variable {name}", line
+            )
+        # Property reads on anything but instances are guarded, so this was a
+        # missing field or method
+        return RuntimeError(None, f"undefined property {name}", line)
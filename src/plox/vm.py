@@ -0,0 +1,471 @@
+from .builtins import Clock
+from .classes import LoxClass, LoxInstance
+from .compiler import (
+    OP_ADD,
+    OP_CALL,
+    OP_CELL,
+    OP_CLASS,
+    OP_CLOSURE,
+    OP_CONSTANT,
+    OP_DEFINE_GLOBAL,
+    OP_DIVIDE,
+    OP_EQUAL,
+    OP_FALSE,
+    OP_GET_CELL,
+    OP_GET_GLOBAL,
+    OP_GET_LOCAL,
+    OP_GET_PROPERTY,
+    OP_GET_SUPER,
+    OP_GET_UPVALUE,
+    OP_GREATER,
+    OP_GREATER_EQUAL,
+    OP_INHERIT,
+    OP_INVOKE,
+    OP_JUMP,
+    OP_JUMP_IF_FALSE,
+    OP_JUMP_IF_TRUE,
+    OP_LESS,
+    OP_LESS_EQUAL,
+    OP_METHOD,
+    OP_MULTIPLY,
+    OP_NEGATE,
+    OP_NIL,
+    OP_NOT,
+    OP_NOT_EQUAL,
+    OP_POP,
+    OP_POP_JUMP_IF_FALSE,
+    OP_POPN,
+    OP_PRINT,
+    OP_RETURN,
+    OP_SET_CELL,
+    OP_SET_GLOBAL,
+    OP_SET_LOCAL,
+    OP_SET_PROPERTY,
+    OP_SET_UPVALUE,
+    OP_SUBTRACT,
+    OP_SUPER_INVOKE,
+    OP_TRUE,
+    Compiler,
+)
+from .env import Cell
+from .errors import RuntimeError
+from .interpreter import stringify
+
+
+class Closure:
+    __slots__ = ("proto", "cells")
+
+    def __init__(self, proto, cells):
+        self.proto = proto
+        self.cells = cells
+
+    def arity(self):
+        return self.proto.arity
+
+    def bind(self, instance):
+        return BoundMethod(instance, self)
+
+    def __repr__(self):
+        return f"<fn {self.proto.name}>"
+
+
+class BoundMethod:
+    __slots__ = ("receiver", "method")
+
+    def __init__(self, receiver, method):
+        self.receiver = receiver
+        self.method = method
+
+    def arity(self):
+        return self.method.arity()
+
+    def __repr__(self):
+        return repr(self.method)
+
+
+class VM:
+    def __init__(self, lox):
+        self.lox = lox
+        self.globals = {"clock": Clock()}
+        self.stack = []
+        self.max_depth = lox.max_depth
+
+    def interpret(self, statements):
+        proto = Compiler().compile(statements)
+        try:
+            self.run(Closure(proto, ()))
+        except RuntimeError as e:
+            self.stack.clear()
+            self.lox.runtime_error(e)
+
+    def error(self, proto, pos, msg):
+        return RuntimeError(None, msg, proto.chunk.lines[pos])
+
+    def arity_error(self, proto, pos, expected, got):
+        return self.error(
+            proto, pos, f"wrong argument count: expected {expected}, got {got}"
+        )
+
+    def numbers_error(self, proto, pos, a, b):
+        return self.error(
+            proto,
+            pos,
+            f"operands must be numbers, are {stringify(a)} and {stringify(b)}",
+        )
+
+    def prepare_call(self, callee, argc, proto, pos):
+        # Handles every callable except plain closures. Returns the closure
+        # to enter, or None if the call has already been completed.
+        stack = self.stack
+        if type(callee) is BoundMethod:
+            stack[-1 - argc] = callee.receiver
+            callee = callee.method
+            if callee.proto.arity != argc:
+                raise self.arity_error(proto, pos, callee.proto.arity, argc)
+            return callee
+        if type(callee) is Closure:
+            if callee.proto.arity != argc:
+                raise self.arity_error(proto, pos, callee.proto.arity, argc)
+            return callee
+        if type(callee) is LoxClass:
+            stack[-1 - argc] = LoxInstance(callee)
+            init = callee.find_method("init")
+            if init is None:
+                if argc != 0:
+                    raise self.arity_error(proto, pos, 0, argc)
+                return None
+            if init.proto.arity != argc:
+                raise self.arity_error(proto, pos, init.proto.arity, argc)
+            return init
+        if not hasattr(callee, "call"):
+            raise self.error(proto, pos, "can only call functions or classes")
+        if argc != callee.arity():
+            raise self.arity_error(proto, pos, callee.arity(), argc)
+        args = stack[len(stack) - argc :]
+        del stack[len(stack) - argc - 1 :]
+        stack.append(callee.call(self, args))
+        return None
+
+    def find_method(self, instance, name, proto, pos):
+        if type(instance) is not LoxInstance:
+            raise self.error(proto, pos, "only instances have properties")
+        method = instance.parent.find_method(name)
+        if method is None:
+            raise self.error(proto, pos, f"undefined property {name}")
+        return method
+
+    def run(self, closure):
+        stack = self.stack
+        push = stack.append
+        pop = stack.pop
+        globals_ = self.globals
+        frames = []
+        max_depth = self.max_depth
+
+        proto = closure.proto
+        code = proto.chunk.code
+        constants = proto.chunk.constants
+        cells = closure.cells
+        base = len(stack)
+        push(closure)
+        ip = 0
+
+        # Instructions are roughly ordered by how often they run in typical
+        # programs, since every comparison in this chain costs time
+        while True:
+            op = code[ip]
+            if op == OP_GET_LOCAL:
+                push(stack[base + code[ip + 1]])
+                ip += 2
+            elif op == OP_CONSTANT:
+                push(constants[code[ip + 1]])
+                ip += 2
+            elif op == OP_GET_GLOBAL:
+                name = constants[code[ip + 1]]
+                if name not in globals_:
+                    raise self.error(
+                        proto, ip, f"Attempt to access undefined variable {name}"
+                    )
+                push(globals_[name])
+                ip += 2
+            elif op == OP_POP_JUMP_IF_FALSE:
+                value = pop()
+                if value is None or value is False:
+                    ip = code[ip + 1]
+                else:
+                    ip += 2
+            elif op == OP_LESS:
+                b = pop()
+                a = stack[-1]
+                if type(a) is not float or type(b) is not float:
+                    raise self.numbers_error(proto, ip, a, b)
+                stack[-1] = a < b
+                ip += 1
+            elif op == OP_ADD:
+                b = pop()
+                a = stack[-1]
+                ta = type(a)
+                if ta is not type(b) or (ta is not float and ta is not str):
+                    raise self.error(
+                        proto,
+                        ip,
+                        "can only add numbers or strings, "
+                        f"adding {stringify(a)} and {stringify(b)}",
+                    )
+                stack[-1] = a + b
+                ip += 1
+            elif op == OP_SUBTRACT:
+                b = pop()
+                a = stack[-1]
+                if type(a) is not float or type(b) is not float:
+                    raise self.numbers_error(proto, ip, a, b)
+                stack[-1] = a - b
+                ip += 1
+            elif op == OP_CALL:
+                argc = code[ip + 1]
+                callee = stack[-1 - argc]
+                if type(callee) is not Closure or callee.proto.arity != argc:
+                    callee = self.prepare_call(callee, argc, proto, ip)
+                    if callee is None:
+                        ip += 2
+                        continue
+                if len(frames) >= max_depth:
+                    raise self.error(proto, ip, "Stack overflow")
+                frames.append((proto, code, constants, cells, ip + 2, base))
+                proto = callee.proto
+                code = proto.chunk.code
+                constants = proto.chunk.constants
+                cells = callee.cells
+                base = len(stack) - argc - 1
+                ip = 0
+                for slot in proto.cells:
+                    stack[base + slot] = Cell(stack[base + slot])
+            elif op == OP_RETURN:
+                result = pop()
+                del stack[base:]
+                if not frames:
+                    return result
+                proto, code, constants, cells, ip, base = frames.pop()
+                push(result)
+            elif op == OP_INVOKE:
+                argc = code[ip + 2]
+                receiver = stack[-1 - argc]
+                name = constants[code[ip + 1]]
+                slot = None
+                if type(receiver) is LoxInstance:
+                    slot = receiver.shape.index.get(name)
+                if slot is not None:
+                    # Fields shadow methods, so this is a plain call of the field
+                    callee = receiver.values[slot]
+                    stack[-1 - argc] = callee
+                else:
+                    callee = self.find_method(receiver, name, proto, ip + 1)
+                if type(callee) is not Closure or callee.proto.arity != argc:
+                    callee = self.prepare_call(callee, argc, proto, ip)
+                    if callee is None:
+                        ip += 3
+                        continue
+                if len(frames) >= max_depth:
+                    raise self.error(proto, ip, "Stack overflow")
+                frames.append((proto, code, constants, cells, ip + 3, base))
+                proto = callee.proto
+                code = proto.chunk.code
+                constants = proto.chunk.constants
+                cells = callee.cells
+                base = len(stack) - argc - 1
+                ip = 0
+                for slot in proto.cells:
+                    stack[base + slot] = Cell(stack[base + slot])
+            elif op == OP_SET_LOCAL:
+                stack[base + code[ip + 1]] = stack[-1]
+                ip += 2
+            elif op == OP_POP:
+                pop()
+                ip += 1
+            elif op == OP_JUMP:
+                ip = code[ip + 1]
+            elif op == OP_MULTIPLY:
+                b = pop()
+                a = stack[-1]
+                if type(a) is not float or type(b) is not float:
+                    raise self.numbers_error(proto, ip, a, b)
+                stack[-1] = a * b
+                ip += 1
+            elif op == OP_LESS_EQUAL:
+                b = pop()
+                a = stack[-1]
+                if type(a) is not float or type(b) is not float:
+                    raise self.numbers_error(proto, ip, a, b)
+                stack[-1] = a <= b
+                ip += 1
+            elif op == OP_GREATER:
+                b = pop()
+                a = stack[-1]
+                if type(a) is not float or type(b) is not float:
+                    raise self.numbers_error(proto, ip, a, b)
+                stack[-1] = a > b
+                ip += 1
+            elif op == OP_GREATER_EQUAL:
+                b = pop()
+                a = stack[-1]
+                if type(a) is not float or type(b) is not float:
+                    raise self.numbers_error(proto, ip, a, b)
+                stack[-1] = a >= b
+                ip += 1
+            elif op == OP_EQUAL:
+                b = pop()
+                stack[-1] = stack[-1] == b
+                ip += 1
+            elif op == OP_NOT_EQUAL:
+                b = pop()
+                stack[-1] = stack[-1] != b
+                ip += 1
+            elif op == OP_DIVIDE:
+                b = pop()
+                a = stack[-1]
+                if type(a) is not float or type(b) is not float:
+                    raise self.numbers_error(proto, ip, a, b)
+                if b == 0.0:
+                    raise self.error(proto, ip, "Division by 0")
+                stack[-1] = a / b
+                ip += 1
+            elif op == OP_GET_PROPERTY:
+                instance = stack[-1]
+                name = constants[code[ip + 1]]
+                slot = None
+                if type(instance) is LoxInstance:
+                    slot = instance.shape.index.get(name)
+                if slot is not None:
+                    stack[-1] = instance.values[slot]
+                else:
+                    method = self.find_method(instance, name, proto, ip)
+                    stack[-1] = BoundMethod(instance, method)
+                ip += 2
+            elif op == OP_SET_PROPERTY:
+                value = pop()
+                instance = stack[-1]
+                if type(instance) is not LoxInstance:
+                    raise self.error(
+                        proto, ip, "can only set properties on instances"
+                    )
+                instance.set(constants[code[ip + 1]], value)
+                stack[-1] = value
+                ip += 2
+            elif op == OP_GET_UPVALUE:
+                push(cells[code[ip + 1]].value)
+                ip += 2
+            elif op == OP_SET_UPVALUE:
+                cells[code[ip + 1]].value = stack[-1]
+                ip += 2
+            elif op == OP_GET_CELL:
+                push(stack[base + code[ip + 1]].value)
+                ip += 2
+            elif op == OP_SET_CELL:
+                stack[base + code[ip + 1]].value = stack[-1]
+                ip += 2
+            elif op == OP_SET_GLOBAL:
+                name = constants[code[ip + 1]]
+                if name not in globals_:
+                    raise self.error(proto, ip, f"Undefined variable {name}")
+                globals_[name] = stack[-1]
+                ip += 2
+            elif op == OP_NIL:
+                push(None)
+                ip += 1
+            elif op == OP_TRUE:
+                push(True)
+                ip += 1
+            elif op == OP_FALSE:
+                push(False)
+                ip += 1
+            elif op == OP_NOT:
+                value = stack[-1]
+                stack[-1] = value is None or value is False
+                ip += 1
+            elif op == OP_NEGATE:
+                value = stack[-1]
+                if type(value) is not float:
+                    raise self.error(
+                        proto, ip, f"Operand must be a number, is {stringify(value)}"
+                    )
+                stack[-1] = -value
+                ip += 1
+            elif op == OP_JUMP_IF_FALSE:
+                value = stack[-1]
+                if value is None or value is False:
+                    ip = code[ip + 1]
+                else:
+                    ip += 2
+            elif op == OP_JUMP_IF_TRUE:
+                value = stack[-1]
+                if value is None or value is False:
+                    ip += 2
+                else:
+                    ip = code[ip + 1]
+            elif op == OP_POPN:
+                del stack[len(stack) - code[ip + 1] :]
+                ip += 2
+            elif op == OP_PRINT:
+                print(stringify(pop()))
+                ip += 1
+            elif op == OP_CLOSURE:
+                function = constants[code[ip + 1]]
+                captured = tuple(
+                    stack[base + index] if is_local else cells[index]
+                    for is_local, index in function.captures
+                )
+                push(Closure(function, captured))
+                ip += 2
+            elif op == OP_CELL:
+                stack[-1] = Cell(stack[-1])
+                ip += 1
+            elif op == OP_DEFINE_GLOBAL:
+                globals_[constants[code[ip + 1]]] = pop()
+                ip += 2
+            elif op == OP_GET_SUPER:
+                superclass = pop()
+                method = superclass.find_method(constants[code[ip + 1]])
+                if method is None:
+                    raise self.error(
+                        proto, ip, f"undefined property {constants[code[ip + 1]]}"
+                    )
+                stack[-1] = BoundMethod(stack[-1], method)
+                ip += 2
+            elif op == OP_SUPER_INVOKE:
+                argc = code[ip + 2]
+                superclass = pop()
+                callee = superclass.find_method(constants[code[ip + 1]])
+                if callee is None:
+                    raise self.error(
+                        proto, ip + 1, f"undefined property {constants[code[ip + 1]]}"
+                    )
+                if callee.proto.arity != argc:
+                    raise self.arity_error(proto, ip, callee.proto.arity, argc)
+                if len(frames) >= max_depth:
+                    raise self.error(proto, ip, "Stack overflow")
+                frames.append((proto, code, constants, cells, ip + 3, base))
+                proto = callee.proto
+                code = proto.chunk.code
+                constants = proto.chunk.constants
+                cells = callee.cells
+                base = len(stack) - argc - 1
+                ip = 0
+                for slot in proto.cells:
+                    stack[base + slot] = Cell(stack[base + slot])
+            elif op == OP_CLASS:
+                push(LoxClass(constants[code[ip + 1]], None, {}))
+                ip += 2
+            elif op == OP_INHERIT:
+                klass = pop()
+                superclass = stack[-1]
+                if type(superclass) is not LoxClass:
+                    raise self.error(proto, ip, "superclass must be a class")
+                klass.superclass = superclass
+                klass.methods.update(superclass.methods)
+                ip += 1
+            elif op == OP_METHOD:
+                method = pop()
+                stack[-1].methods[constants[code[ip + 1]]] = method
+                ip += 2
+            else:
+                raise ValueError(f"unknown opcode {op}")
@@ -0,0 +1,210 @@
+import re
+import sys
+from time import perf_counter
+
+from .expr import Get, Set
+from .nodes import walk
+from .parser import Parser
+from .resolver import Resolver
+from .stmt import LazyFunction
+from .tokenizer import FastTokenizer
+
+# Seconds between checks for whether the script has changed
+INTERVAL = 0.2
+
+# The lexemes that decide where a top-level declaration ends: brackets and
+# semicolons, and strings and comments, which can hide them
+BOUNDARY = re.compile(r'"[^"]*"?|//[^\n]*|[{}();]')
+# What would otherwise end a declaration doesn't if an else follows it
+ELSE = re.compile(r"(?:\s|//[^\n]*)*else\b")
+# Text that leaves the tokenizer where it started: nothing but whitespace and
+# whole comments
+BLANK = re.compile(r"(?:[ \t\r\n]|//[^\n]*\n)*")
+
+
+# Splits source[start:end] into the text of each top-level declaration, going
+# by brackets and semicolons. Each text runs from just after the end of the
+# one before, so they include the whitespace and comments in front. Returns
+# the texts, and whether the last one could end where end is.
+def split(source, start, end):
+    texts = []
+    braces = parens = 0
+    for match in BOUNDARY.finditer(source, start, end):
+        lexeme = match.group()
+        if lexeme == "{":
+            braces += 1
+            continue
+        if lexeme == "(":
+            parens += 1
+            continue
+        if lexeme == ")":
+            parens -= 1
+            continue
+        if lexeme == "}":
+            braces -= 1
+        elif lexeme != ";":
+            continue
+        if braces > 0 or parens > 0:
+            continue
+        # Past a stray bracket the parser reports; splitting there is as good
+        # as anywhere
+        braces = parens = 0
+        if ELSE.match(source, match.end(), end):
+            continue
+        texts.append(source[start : match.end()])
+        start = match.end()
+    if start == end:
+        return texts, True
+    texts.append(source[start:end])
+    return texts, BLANK.fullmatch(source, start, end) is not None
+
+
+# A top-level declaration's text, where it starts, and what compiling it
+# produced: its tokens, its statements after resolving and the passes, the
+# property access sites in them, the functions in them whose bodies haven't
+# been parsed yet in --lazy mode, and how many declarations were parsed, which
+# is one unless there were errors or it's only whitespace
+class Chunk:
+    __slots__ = ("text", "line", "tokens", "statements", "sites", "lazy", "count")
+
+    def __init__(self, text, line):
+        self.text = text
+        self.line = line
+
+
+# Compiles successive versions of a script, keeping what each top-level
+# declaration compiled to. Since names at the top level are globals, resolved
+# when they are used, a top-level declaration compiles the same whatever
+# surrounds it, as --stream relies on. So of a new version, only the
+# declarations whose text changed are tokenized, parsed, resolved and
+# optimized again; those before the first change are kept as they are, and
+# those after the last have their tokens moved to their new lines.
+class Watcher:
+    def __init__(self, lox):
+        self.lox = lox
+        # The chunks of the last version that compiled without errors, which
+        # together make up its source
+        self.chunks = []
+        self.parser = None
+
+    # Returns the statements of source, or None if there were static errors
+    def compile(self, source):
+        began = perf_counter()
+        old = self.chunks
+        # The declarations that haven't changed at the start. The last one may
+        # not end in a ; or }, and then may run on into what was added after
+        # it. Any others that don't are only whitespace and comments.
+        i = start = 0
+        while (
+            i < len(old)
+            and (i < len(old) - 1 or old[i].text[-1] in ";}")
+            and source.startswith(old[i].text, start)
+        ):
+            start += len(old[i].text)
+            i += 1
+        if i and ELSE.match(source, start):
+            # Back to the statement the else belongs to
+            i -= 1
+            while i and old[i].text[-1] not in ";}":
+                i -= 1
+            start = sum(len(chunk.text) for chunk in old[:i])
+        # and at the end
+        j, end = len(old), len(source)
+        while j > i and source.endswith(old[j - 1].text, start, end):
+            j -= 1
+            end -= len(old[j].text)
+        texts, clean = split(source, start, end)
+        if not clean and end < len(source):
+            # The last declaration that changed runs on into the ones after
+            texts = split(source, start, len(source))[0]
+            j = len(old)
+
+        line = 1 + source.count("\n", 0, start)
+        fresh = []
+        for text in texts:
+            fresh.append(self.tokenize(text, line))
+            line += text.count("\n")
+        # Only once all of them have been tokenized, so errors come in the
+        # same order as when compiling the whole source
+        for chunk in fresh:
+            self.parse(chunk)
+        if not self.resolve(fresh):
+            return None
+
+        kept = old[:i] + old[j:]
+        if j < len(old) and old[j].line != line:
+            shift = line - old[j].line
+            for chunk in old[j:]:
+                chunk.line += shift
+                for token in chunk.tokens:
+                    token.line += shift
+        # Property caches from the last run hold shapes that are gone now
+        for chunk in kept:
+            # Including those in bodies the last run parsed
+            parsed = [f for f in chunk.lazy if f.__class__ is not LazyFunction]
+            if parsed:
+                chunk.lazy = [f for f in chunk.lazy if f.__class__ is LazyFunction]
+                self.find_sites(chunk, [function.body for function in parsed])
+            for site in chunk.sites:
+                site.shape = site.entry = site.cache = None
+        self.chunks = old[:i] + fresh + old[j:]
+        statements = [s for chunk in self.chunks for s in chunk.statements]
+
+        if old:
+            elapsed = perf_counter() - began
+            compiled = sum(chunk.count for chunk in fresh)
+            total = compiled + sum(chunk.count for chunk in kept)
+            print(
+                f"Recompiled {compiled} of {total} declarations in {elapsed:.3f}s",
+                file=sys.stderr,
+            )
+        return statements
+
+    def tokenize(self, text, line):
+        chunk = Chunk(text, line)
+        chunk.tokens = FastTokenizer(self.lox, text, line).tokenize()
+        return chunk
+
+    def parse(self, chunk):
+        if self.parser is None:
+            self.parser = Parser(self.lox, chunk.tokens)
+        else:
+            self.parser.feed(chunk.tokens)
+        chunk.statements = []
+        while not self.parser.is_at_end():
+            chunk.statements.append(self.parser.declaration())
+        chunk.count = len(chunk.statements)
+
+    # Resolves the statements of chunks and runs the passes over them, like
+    # lox.resolve, but with one resolver and one of each pass for all of them.
+    # Returns whether there were no static errors.
+    def resolve(self, chunks):
+        lox = self.lox
+        if not chunks:
+            return True
+        if lox.had_error:
+            return False
+        resolver = Resolver(lox)
+        for chunk in chunks:
+            resolver.resolve_statements(chunk.statements)
+        if lox.had_error:
+            return False
+        passes = [cls(lox) for cls in lox.passes]
+        for chunk in chunks:
+            chunk.statements = lox.optimize(chunk.statements, passes)
+            chunk.sites = []
+            chunk.lazy = []
+            # Only property accesses have caches, and they need a dot
+            if "." in chunk.text:
+                self.find_sites(chunk, chunk.statements)
+        return True
+
+    # Adds the property access sites in nodes to those of chunk. walk doesn't
+    # go into bodies that haven't been parsed, so those functions are kept to
+    # look in once they have been.
+    def find_sites(self, chunk, nodes):
+        for node in walk(nodes):
+            if type(node) in (Get, Set):
+                chunk.sites.append(node)
+            elif type(node) is LazyFunction:
+                chunk.lazy.append(node)
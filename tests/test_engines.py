@@ -0,0 +1,31 @@
+import pytest
+
+from plox.lox import ENGINES, Lox
+
+FUNCTIONS = """\
+fun f() {}
+class A { m() {} }
+print clock;
+print f;
+print A().m;
+{
+  fun f() {}
+  print f;
+  print f + 1;
+}
+"""
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_functions_print_alike(engine, capsys):
+    # Native functions print like Lox ones, also in error messages, and a
+    # shadowing function prints its own name even if the engine renamed it
+    Lox(engine).run(FUNCTIONS)
+    assert capsys.readouterr().out.splitlines() == [
+        "<fn clock>",
+        "<fn f>",
+        "<fn m>",
+        "<fn f>",
+        "Runtime error at line 9: "
+        "can only add numbers or strings, adding <fn f> and 1",
+    ]
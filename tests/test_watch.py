@@ -0,0 +1,35 @@
+from plox.lox import MAX_DEPTH, PASSES, Lox
+from plox.watch import Watcher
+
+FUNCTIONS = "".join(f"fun f{i}() {{ return {i}; }}\n" for i in range(200))
+
+
+def compile_versions(versions):
+    lox = Lox("tree", PASSES, False, MAX_DEPTH)
+    watcher = Watcher(lox)
+    for source in versions:
+        assert watcher.compile(source) is not None
+
+
+def test_comment_above_the_code_keeps_the_rest(capsys):
+    source = "// header\n" + FUNCTIONS + "print f1();\n"
+    # A comment added at the top is a chunk of its own, which doesn't end in
+    # a ; or }, and mustn't stop later versions from keeping what follows it
+    commented = "// more\n" + source
+    compile_versions(
+        [source, commented, commented.replace("return 100;", "return 7;")]
+    )
+    reports = capsys.readouterr().err.splitlines()
+    assert reports[-1].startswith("Recompiled 1 of 201 declarations")
+
+
+def test_else_after_a_comment_joins_its_if(capsys):
+    lox = Lox("tree", PASSES, False, MAX_DEPTH)
+    watcher = Watcher(lox)
+    for source in (
+        "if (false) print 1;\n// c\nprint 3;\n",
+        "if (false) print 1;\n// c\nelse print 2;\nprint 3;\n",
+    ):
+        lox.interpreter = lox.engine(lox)
+        lox.run_statements(watcher.compile(source))
+    assert capsys.readouterr().out.splitlines()[-2:] == ["2", "3"]